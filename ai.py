@@ -6,90 +6,800 @@
           heuristic function that is more precise (take open/close into
           consideration) <- Done but could there be any efficiency improvement?
           Three-player minimax/alpha-beta-pruning <- Hmmm...
+          Transposition table <- Done (SearchState.ttable)
+          Iterative deepening with a time budget <- Done
+          Move ordering <- Done (SearchState.orderer, see ordering.py)
+          Principal variation search <- Done (SEARCH_PVS)
+          MTD(f) <- Done (SEARCH_MTDF)
+          Quiescence search <- Done (SearchState.use_quiescence)
+          Null-move pruning, late move reductions <- Done
+          (SearchState.use_null_move, SearchState.use_lmr)
+          Threat extensions <- Done (SearchState.use_extensions)
 """
 
+from time import time
+
+from model import (PLAYER_COUNT, ZOBRIST_TURN, TT_EXACT, TT_LOWER,
+                   TT_UPPER, NO_MOVE, pack_move, unpack_move_x,
+                   unpack_move_y)
+from pieces import HVALTAB2
+from threats import get_five_cells, get_recent_five_cells
+
+MAX_SEARCH_DEPTH = 64
+INFINITY = 1 << 60
+
+# How many nodes (quiescence ones included) to search between two looks
+# at the clock.
+TIME_CHECK_INTERVAL = 64
+
+# Search algorithms, see SearchState.algorithm.
+SEARCH_ALPHABETA = 0
+SEARCH_PVS = 1
+SEARCH_MTDF = 2
+SEARCH_NAMES = ['alphabeta', 'pvs', 'mtdf']
+
+# Root aspiration window of the PVS iterations: half-width first, and the
+# half-width past which a failing side just opens up to INFINITY.
+ASPIRATION_DELTA = 64
+ASPIRATION_LIMIT = 1 << 16
+
+# Quiescence search: nodes per root search, plies past the horizon, and
+# how many of the last moves are looked at for fours.
+QUIESCENCE_NODE_LIMIT = 20000
+QUIESCENCE_MAX_PLY = 8
+QUIESCENCE_HISTORY = 4
+
+# Null-move pruning: the depth taken off the probe, and the least depth
+# left for one.
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+# Late move reductions: moves searched at full depth before reducing,
+# and the least depth left for a reduction.
+LMR_FULL_MOVES = 3
+LMR_MIN_DEPTH = 3
+
+# Threat extensions, in half plies: a four or the only defence against
+# one extends by a ply, a run scoring at least THREE_HVAL (an open three)
+# by half a ply, and one line gets at most MAX_LINE_EXTENSIONS half
+# plies in all.
+FOUR_EXTENSION = 2
+THREE_EXTENSION = 1
+THREE_HVAL = HVALTAB2[0][3]
+MAX_LINE_EXTENSIONS = 2
+
+def flip_bound(flag):
+    """ The bound type of a value seen from the other side. """
+    if flag == TT_LOWER:
+        return TT_UPPER
+    elif flag == TT_UPPER:
+        return TT_LOWER
+    return flag
+
+class SearchState(object):
+    """ Data shared by all the Futures of one search tree. """
+    def __init__(self, ttable=None, orderer=None):
+        self.ttable = ttable
+        # without an orderer, moves are tried in raster order.
+        self.orderer = orderer
+        self.nodes = 0
+        self.cutoffs = 0
+        self.start_time = time()
+        # wall-clock deadline in seconds, 0.0 means no limit.
+        self.deadline = 0.0
+        # set by request_stop() or when the deadline passes. An aborted
+        # search returns garbage values that must not be used.
+        self.stopped = False
+        # only set by request_stop(): the deadline ends one search, a
+        # request all of them until reset_stop().
+        self.stop_requested = False
+        # tried first at the root, fed forward between iterations.
+        self.root_move = NO_MOVE
+        self.completed_depth = 0
+        self.algorithm = SEARCH_ALPHABETA
+        # PVS statistics: null-window searches that had to be redone with
+        # the full window, and root aspiration windows that failed.
+        self.researches = 0
+        self.aspiration_fails = 0
+        # MTD(f) statistics: zero-window passes run.
+        self.passes = 0
+        # quiescence search at the horizon: its nodes, and the leaves it
+        # had to cut short at the ply or node limit.
+        self.use_quiescence = False
+        self.qnode_limit = QUIESCENCE_NODE_LIMIT
+        self.qnodes = 0
+        self.qcutoffs = 0
+        # alphabeta pruning: null-move probes and the ones that cut off,
+        # late moves searched reduced and the ones searched again at full
+        # depth after failing high.
+        self.use_null_move = False
+        self.use_lmr = False
+        self.in_null_move = False
+        self.null_probes = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.reduction_researches = 0
+        # threat extensions made, and the half plies the current line got.
+        self.use_extensions = False
+        self.line_extensions = 0
+        self.extensions = 0
+
+    def new_search(self):
+        """ Resets the counters and ages the move orderer before a new
+            root search.
+        """
+        self.reset_counters()
+        if self.orderer is not None:
+            self.orderer.age()
+
+    def reset_counters(self):
+        """ Resets the counters and the clock, keeping the orderer's
+            history: for a search that is part of a larger one.
+        """
+        self.nodes = 0
+        self.cutoffs = 0
+        self.researches = 0
+        self.aspiration_fails = 0
+        self.qnodes = 0
+        self.qcutoffs = 0
+        self.null_probes = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.reduction_researches = 0
+        self.extensions = 0
+        self.stopped = self.stop_requested
+        self.start_time = time()
+
+    def get_elapsed(self):
+        return time() - self.start_time
+
+    def get_nodes_per_second(self):
+        elapsed = self.get_elapsed()
+        if elapsed <= 0.0:
+            return 0.0
+        return self.nodes / elapsed
+
+    def start_timer(self, millis):
+        """ Gives the next search millis milliseconds, or no limit for
+            0. A stop by the last deadline is forgotten.
+        """
+        self.stopped = self.stop_requested
+        if millis > 0:
+            self.deadline = time() + millis / 1000.0
+        else:
+            self.deadline = 0.0
+
+    def request_stop(self):
+        self.stop_requested = True
+        self.stopped = True
+
+    def reset_stop(self):
+        self.stop_requested = False
+        self.stopped = False
+
+    def poll(self):
+        """ Returns True if the running search should be aborted. """
+        if self.stopped:
+            return True
+        if (self.nodes + self.qnodes) % TIME_CHECK_INTERVAL == 0:
+            return self.check_stop()
+        return False
+
+    def check_stop(self):
+        """ poll() without waiting for the next interval, for searches
+            with few and slow nodes like the threat solver's.
+        """
+        if (not self.stopped and self.deadline > 0.0 and
+                time() >= self.deadline):
+            self.stopped = True
+        return self.stopped
+
 class Future(object):
-    def __init__(self, board, player):
+    def __init__(self, board, player, state=None):
         self.board = board
         self.player = player
         self.move = None
+        if state is None:
+            state = SearchState()
+        self.state = state
 
     def heuristic_eval(self):
         # XXX: using different marking scheme on self/enemy players?
-
-        # evaluating the max player's heuristic value.
-        self_hval = 0
-        self_group_man = self.board.get_piece_groups()[self.player.pid]
-        for piece_groups in self_group_man.get_groups():
-            for piece_group in piece_groups:
-                self_hval += piece_group.heuristic_eval(self.board)
-
-        # evaluating the sum of the enemy players' heuristic values.
+        # The group managers keep the per-player sums up to date, so this
+        # is O(1).
+        self_hval = self.board.get_hval(self.player.pid)
         enemy_hvals = 0
-        for pid, group_man in enumerate(self.board.get_piece_groups()):
-            if pid == self.player.pid:
-                continue
-            for piece_groups in group_man.get_groups():
-                for piece_group in piece_groups:
-                    enemy_hvals += piece_group.heuristic_eval(self.board)
-
+        for pid in xrange(PLAYER_COUNT):
+            if pid != self.player.pid:
+                enemy_hvals += self.board.get_hval(pid)
         return self_hval - 2 * enemy_hvals
 
-    def alphabeta(self, depth, alpha, beta, mover):
-        if depth == 0:
+    def alphabeta(self, depth, alpha, beta, mover, ply=0):
+        self.state.nodes += 1
+        if self.state.poll():
+            return 0
+        elif depth == 0:
             # leaf reached -- just get the heuristic value
+            if self.state.use_quiescence:
+                return self.quiesce(alpha, beta, mover)
             return self.heuristic_eval()
-        elif self.board.get_piece_groups()[mover.get_prev().pid].count_of(5):
-            # ending case -- someone is winning here.
+        elif self.board.last_move_wins():
+            # ending case -- the previous mover just won.
             return self.heuristic_eval()
-        elif mover is self.player: # max move
-            saved_pmoves = self.board.get_possible_moves()
-            pm_iter = saved_pmoves.get_iterator()
-            while pm_iter.has_next():
-                (x, y) = pm_iter.get_next()
-                self.board.set_possible_moves(saved_pmoves.make_copy())
-                self.board.put_at(x, y, mover)
-                next_future = Future(self.board, self.player)
-                future_value = next_future.alphabeta(depth - 1,
-                        alpha, beta, mover.get_next())
-                self.board.del_at(x, y) # Restore the board.
+
+        # consult the transposition table before expanding the moves.
+        # The root never returns from here since it has to find a move.
+        ttable = self.state.ttable
+        key = 0
+        hash_move = NO_MOVE
+        if ttable is not None:
+            key = self.board.get_hash() ^ ZOBRIST_TURN[mover.pid]
+            found = ttable.probe(key)
+            if found:
+                hash_move = ttable.probed_move
+            if found and ply > 0 and ttable.probed_depth >= depth:
+                value = ttable.probed_value
+                flag = ttable.probed_flag
+                if flag == TT_EXACT:
+                    return value
+                elif flag == TT_LOWER and value >= beta:
+                    return value
+                elif flag == TT_UPPER and value <= alpha:
+                    return value
+
+        # a threat of five on the board rules out both prunings.
+        state = self.state
+        quiet = False
+        if ((state.use_null_move and depth >= NULL_MOVE_MIN_DEPTH) or
+                (state.use_lmr and depth >= LMR_MIN_DEPTH)):
+            quiet = not self.has_fours()
+        if (quiet and state.use_null_move and depth >= NULL_MOVE_MIN_DEPTH
+                and ply > 0 and not state.in_null_move):
+            # let mover pass: if the reduced search still fails high
+            # (low for min), a real move would only do better.
+            state.null_probes += 1
+            state.in_null_move = True
+            next_future = Future(self.board, self.player, state)
+            if mover is self.player:
+                value = next_future.alphabeta(
+                        depth - 1 - NULL_MOVE_REDUCTION, beta - 1, beta,
+                        mover.get_next(), ply + 1)
+                cut = value >= beta
+            else:
+                value = next_future.alphabeta(
+                        depth - 1 - NULL_MOVE_REDUCTION, alpha, alpha + 1,
+                        mover.get_next(), ply + 1)
+                cut = value <= alpha
+            state.in_null_move = False
+            if cut and not state.stopped:
+                state.null_cutoffs += 1
+                return value
+        reduce = quiet and state.use_lmr and depth >= LMR_MIN_DEPTH
+        only_defence = NO_MOVE
+        if state.use_extensions:
+            only_defence = self.get_only_defence(mover)
+
+        if mover is self.player: # max move
+            orig_alpha = alpha
+            pmoves = self.board.get_possible_moves()
+            index = 0
+            for move in self.get_ordered_moves(pmoves, ply, mover,
+                                               hash_move):
+                future_value = self.search_child(move, index, depth, alpha,
+                        beta, mover, ply, reduce, hash_move, only_defence)
+                index += 1
+                if self.state.stopped:
+                    break
                 if future_value > alpha:
                     alpha = future_value
-                    self.move = [x, y]
+                    self.move = [unpack_move_x(move), unpack_move_y(move)]
                 if beta <= alpha:
+                    self.record_cutoff(move, depth, ply, mover)
                     break
-            self.board.set_possible_moves(saved_pmoves)
+            if self.state.stopped:
+                return alpha
+            if ttable is not None:
+                if alpha <= orig_alpha:
+                    flag = TT_UPPER
+                elif alpha >= beta:
+                    flag = TT_LOWER
+                else:
+                    flag = TT_EXACT
+                ttable.store(key, depth, flag, alpha, self.get_packed_move())
             return alpha
         else: # min move
-            saved_pmoves = self.board.get_possible_moves()
-            pm_iter = saved_pmoves.get_iterator()
-            while pm_iter.has_next():
-                (x, y) = pm_iter.get_next()
-                self.board.set_possible_moves(saved_pmoves.make_copy())
-                self.board.put_at(x, y, mover)
-                next_future = Future(self.board, self.player)
-                future_value = next_future.alphabeta(depth - 1,
-                        alpha, beta, mover.get_next())
-                self.board.del_at(x, y) # Restore the board.
+            orig_beta = beta
+            pmoves = self.board.get_possible_moves()
+            index = 0
+            for move in self.get_ordered_moves(pmoves, ply, mover,
+                                               hash_move):
+                future_value = self.search_child(move, index, depth, alpha,
+                        beta, mover, ply, reduce, hash_move, only_defence)
+                index += 1
+                if self.state.stopped:
+                    break
                 if future_value < beta:
                     beta = future_value
-                    self.move = [x, y]
+                    self.move = [unpack_move_x(move), unpack_move_y(move)]
                 if beta <= alpha:
+                    self.record_cutoff(move, depth, ply, mover)
                     break
-            self.board.set_possible_moves(saved_pmoves)
+            if self.state.stopped:
+                return beta
+            if ttable is not None:
+                if beta >= orig_beta:
+                    flag = TT_LOWER
+                elif beta <= alpha:
+                    flag = TT_UPPER
+                else:
+                    flag = TT_EXACT
+                ttable.store(key, depth, flag, beta, self.get_packed_move())
             return beta
 
+    def search_child(self, move, index, depth, alpha, beta, mover, ply,
+                     reduce, hash_move, only_defence):
+        """ Puts move, the index-th tried, and searches the position
+            after it for alphabeta(), with threat extensions and late
+            move reductions. Returns its value.
+        """
+        state = self.state
+        x = unpack_move_x(move)
+        y = unpack_move_y(move)
+        self.board.put_at(x, y, mover)
+        next_future = Future(self.board, self.player, state)
+        extension = 0
+        if (state.use_extensions and
+                state.line_extensions < MAX_LINE_EXTENSIONS):
+            extension = self.get_extension(x, y, move, mover, only_defence)
+            state.line_extensions += extension
+        extended = extension > 0
+        new_depth = depth - 1
+        if extended:
+            state.extensions += 1
+            # whole plies only: two half plies along the line make one.
+            new_depth += (state.line_extensions // 2 -
+                          (state.line_extensions - extension) // 2)
+        next_mover = mover.get_next()
+        if (reduce and not extended and
+                self.is_late_move(index, move, hash_move, mover)):
+            # a null window one ply shallower; only a move that beats
+            # the bound there gets the full search.
+            state.reductions += 1
+            if mover is self.player:
+                value = next_future.alphabeta(new_depth - 1, alpha,
+                                              alpha + 1, next_mover, ply + 1)
+                better = value > alpha
+            else:
+                value = next_future.alphabeta(new_depth - 1, beta - 1,
+                                              beta, next_mover, ply + 1)
+                better = value < beta
+            if better and not state.stopped:
+                state.reduction_researches += 1
+                value = next_future.alphabeta(new_depth, alpha, beta,
+                                              next_mover, ply + 1)
+        else:
+            value = next_future.alphabeta(new_depth, alpha, beta,
+                                          next_mover, ply + 1)
+        self.board.unmake_at(x, y) # Restore the board.
+        state.line_extensions -= extension
+        return value
+
+    def pvs(self, depth, alpha, beta, mover, ply=0):
+        """ Principal variation search (NegaScout) in negamax form: the
+            value is from mover's view, not self.player's. The first move
+            is searched with the full window, the others with a null
+            window around alpha and again with the full one only when
+            they turn out to be better.
+
+            The table is shared with alphabeta, so entries are converted
+            to self.player's view on the way in and out.
+        """
+        self.state.nodes += 1
+        if self.state.poll():
+            return 0
+        elif depth == 0 and self.state.use_quiescence:
+            return self.negamax_quiesce(alpha, beta, mover)
+        elif depth == 0 or self.board.last_move_wins():
+            return self.negamax_eval(mover)
+
+        ttable = self.state.ttable
+        key = 0
+        hash_move = NO_MOVE
+        if ttable is not None:
+            key = self.board.get_hash() ^ ZOBRIST_TURN[mover.pid]
+            found = ttable.probe(key)
+            if found:
+                hash_move = ttable.probed_move
+            if found and ply > 0 and ttable.probed_depth >= depth:
+                value = ttable.probed_value
+                flag = ttable.probed_flag
+                if mover is not self.player:
+                    value = -value
+                    flag = flip_bound(flag)
+                if flag == TT_EXACT:
+                    return value
+                elif flag == TT_LOWER and value >= beta:
+                    return value
+                elif flag == TT_UPPER and value <= alpha:
+                    return value
+
+        orig_alpha = alpha
+        first = True
+        pmoves = self.board.get_possible_moves()
+        for move in self.get_ordered_moves(pmoves, ply, mover, hash_move):
+            x = unpack_move_x(move)
+            y = unpack_move_y(move)
+            self.board.put_at(x, y, mover)
+            next_future = Future(self.board, self.player, self.state)
+            if first:
+                value = -next_future.pvs(depth - 1, -beta, -alpha,
+                                         mover.get_next(), ply + 1)
+            else:
+                value = -next_future.pvs(depth - 1, -alpha - 1, -alpha,
+                                         mover.get_next(), ply + 1)
+                if alpha < value < beta and not self.state.stopped:
+                    self.state.researches += 1
+                    value = -next_future.pvs(depth - 1, -beta, -alpha,
+                                             mover.get_next(), ply + 1)
+            self.board.unmake_at(x, y) # Restore the board.
+            if self.state.stopped:
+                break
+            first = False
+            if value > alpha:
+                alpha = value
+                self.move = [x, y]
+            if alpha >= beta:
+                self.record_cutoff(move, depth, ply, mover)
+                break
+        if self.state.stopped:
+            return alpha
+        if ttable is not None:
+            if alpha <= orig_alpha:
+                flag = TT_UPPER
+            elif alpha >= beta:
+                flag = TT_LOWER
+            else:
+                flag = TT_EXACT
+            value = alpha
+            if mover is not self.player:
+                value = -value
+                flag = flip_bound(flag)
+            ttable.store(key, depth, flag, value, self.get_packed_move())
+        return alpha
+
+    def zero_window(self, depth, beta, mover, ply=0):
+        """ Fail-soft negamax search with the window (beta - 1, beta),
+            value from mover's view. Returns at least beta if the value is
+            at least beta, and an upper bound below beta otherwise -- as
+            tight as the tree allows, which is what lets MTD(f) converge
+            in a few passes. Shares the table with the other searches.
+        """
+        self.state.nodes += 1
+        if self.state.poll():
+            return 0
+        elif depth == 0 and self.state.use_quiescence:
+            return self.negamax_quiesce(beta - 1, beta, mover)
+        elif depth == 0 or self.board.last_move_wins():
+            return self.negamax_eval(mover)
+
+        ttable = self.state.ttable
+        key = 0
+        hash_move = NO_MOVE
+        if ttable is not None:
+            key = self.board.get_hash() ^ ZOBRIST_TURN[mover.pid]
+            found = ttable.probe(key)
+            if found:
+                hash_move = ttable.probed_move
+            if found and ply > 0 and ttable.probed_depth >= depth:
+                value = ttable.probed_value
+                flag = ttable.probed_flag
+                if mover is not self.player:
+                    value = -value
+                    flag = flip_bound(flag)
+                if flag == TT_EXACT:
+                    return value
+                elif flag == TT_LOWER and value >= beta:
+                    return value
+                elif flag == TT_UPPER and value < beta:
+                    return value
+
+        best = -INFINITY
+        pmoves = self.board.get_possible_moves()
+        for move in self.get_ordered_moves(pmoves, ply, mover, hash_move):
+            x = unpack_move_x(move)
+            y = unpack_move_y(move)
+            self.board.put_at(x, y, mover)
+            next_future = Future(self.board, self.player, self.state)
+            value = -next_future.zero_window(depth - 1, 1 - beta,
+                                             mover.get_next(), ply + 1)
+            self.board.unmake_at(x, y) # Restore the board.
+            if self.state.stopped:
+                break
+            if value > best:
+                best = value
+                self.move = [x, y]
+            if best >= beta:
+                self.record_cutoff(move, depth, ply, mover)
+                break
+        if self.state.stopped or self.move is None:
+            return best
+        if ttable is not None:
+            value = best
+            flag = TT_UPPER
+            if best >= beta:
+                flag = TT_LOWER
+            if mover is not self.player:
+                value = -value
+                flag = flip_bound(flag)
+            ttable.store(key, depth, flag, value, self.get_packed_move())
+        return best
+
+    def mtdf(self, depth, guess, mover):
+        """ MTD(f): zero-window searches around guess until the lower and
+            upper bounds on the value meet. Value from mover's view; the
+            move is the one of the last pass that failed high.
+        """
+        lower = -INFINITY
+        upper = INFINITY
+        value = guess
+        best_move = None
+        while lower < upper:
+            beta = value
+            if value == lower:
+                beta = value + 1
+            self.state.passes += 1
+            value = self.zero_window(depth, beta, mover)
+            if self.state.stopped:
+                break
+            if value < beta:
+                upper = value
+            else:
+                lower = value
+                best_move = self.move
+        if best_move is not None:
+            self.move = best_move
+        return value
+
+    def quiesce(self, alpha, beta, mover, qply=0):
+        """ Extends a leaf with forcing moves only, so a four on the board
+            isn't left hanging at the horizon: mover completes five if it
+            can, blocks the other side's five if it must (all the blocks
+            of an open four lose), and otherwise the position is quiet
+            and the heuristic value stands. Fours are looked for on the
+            lines through the last QUIESCENCE_HISTORY moves. Same view
+            and window as alphabeta().
+        """
+        state = self.state
+        state.qnodes += 1
+        if state.poll():
+            return 0
+        stand = self.heuristic_eval()
+        board = self.board
+        if board.last_move_wins():
+            return stand
+        if qply >= QUIESCENCE_MAX_PLY or state.qnodes >= state.qnode_limit:
+            state.qcutoffs += 1
+            return stand
+
+        wins = get_recent_five_cells(board, QUIESCENCE_HISTORY, mover.pid)
+        if wins:
+            # completing five ends it, nothing else needs a look.
+            return self.quiesce_move(wins[0], alpha, beta, mover, qply)
+        blocks = get_recent_five_cells(board, QUIESCENCE_HISTORY,
+                                       mover.get_next().pid)
+        if not blocks:
+            return stand
+
+        # no standing pat: every block is searched, the best one counts.
+        if mover is self.player:
+            best = -INFINITY
+            for move in blocks:
+                value = self.quiesce_move(move, alpha, beta, mover, qply)
+                if value > best:
+                    best = value
+                if best > alpha:
+                    alpha = best
+                if alpha >= beta:
+                    break
+        else:
+            best = INFINITY
+            for move in blocks:
+                value = self.quiesce_move(move, alpha, beta, mover, qply)
+                if value < best:
+                    best = value
+                if best < beta:
+                    beta = best
+                if alpha >= beta:
+                    break
+        return best
+
+    def has_fours(self):
+        """ Whether someone can complete five on a line through one of
+            the last QUIESCENCE_HISTORY moves.
+        """
+        for pid in xrange(PLAYER_COUNT):
+            if get_recent_five_cells(self.board, QUIESCENCE_HISTORY, pid):
+                return True
+        return False
+
+    def is_late_move(self, index, move, hash_move, mover):
+        """ Whether the move just put may be searched reduced: it comes
+            after the first LMR_FULL_MOVES, isn't the hash move and
+            doesn't make a four.
+        """
+        return (index >= LMR_FULL_MOVES and move != hash_move and
+                not get_five_cells(self.board, unpack_move_x(move),
+                                   unpack_move_y(move), mover.pid))
+
+    def get_only_defence(self, mover):
+        """ The one cell where mover can stop the other side's five
+            through the last move, or NO_MOVE.
+        """
+        move = self.board.get_last_move()
+        if move == NO_MOVE:
+            return NO_MOVE
+        x = unpack_move_x(move)
+        y = unpack_move_y(move)
+        owner = self.board.get_owner_at(x, y)
+        if owner is None or owner is mover:
+            return NO_MOVE
+        cells = get_five_cells(self.board, x, y, owner.pid)
+        if len(cells) == 1:
+            return cells[0]
+        return NO_MOVE
+
+    def get_extension(self, x, y, move, mover, only_defence):
+        """ Half plies to extend the move just put at (x, y) by: a four
+            (any shape) or the only defence against one, or an open three
+            by the length and blockage of its runs.
+        """
+        if (move == only_defence or
+                get_five_cells(self.board, x, y, mover.pid)):
+            extension = FOUR_EXTENSION
+        elif self.board.get_run_hval_at(x, y) >= THREE_HVAL:
+            extension = THREE_EXTENSION
+        else:
+            return 0
+        room = MAX_LINE_EXTENSIONS - self.state.line_extensions
+        if extension > room:
+            extension = room
+        return extension
+
+    def quiesce_move(self, move, alpha, beta, mover, qply):
+        x = unpack_move_x(move)
+        y = unpack_move_y(move)
+        self.board.put_at(x, y, mover)
+        value = Future(self.board, self.player, self.state).quiesce(
+                alpha, beta, mover.get_next(), qply + 1)
+        self.board.unmake_at(x, y) # Restore the board.
+        return value
+
+    def negamax_quiesce(self, alpha, beta, mover):
+        """ quiesce() with window and value in mover's view. """
+        if mover is self.player:
+            return self.quiesce(alpha, beta, mover)
+        return -self.quiesce(-beta, -alpha, mover)
+
+    def negamax_eval(self, mover):
+        if mover is self.player:
+            return self.heuristic_eval()
+        return -self.heuristic_eval()
+
+    def search(self, depth, alpha, beta, mover):
+        """ A root search with the state's algorithm. The value is from
+            self.player's view whichever algorithm runs.
+        """
+        algorithm = self.state.algorithm
+        if algorithm == SEARCH_PVS:
+            if mover is self.player:
+                return self.pvs(depth, alpha, beta, mover)
+            return -self.pvs(depth, -beta, -alpha, mover)
+        elif algorithm == SEARCH_MTDF:
+            # the window only bounds the first guess.
+            return self.mtdf_search(depth, min(max(0, alpha), beta), mover)
+        return self.alphabeta(depth, alpha, beta, mover)
+
+    def mtdf_search(self, depth, guess, mover):
+        """ mtdf() with guess and value in self.player's view. """
+        if mover is self.player:
+            return self.mtdf(depth, guess, mover)
+        return -self.mtdf(depth, -guess, mover)
+
+    def aspiration_search(self, depth, guess, mover):
+        """ Searches with a window around guess, widening whichever side
+            fails until the value falls inside.
+        """
+        delta = ASPIRATION_DELTA
+        alpha = guess - delta
+        beta = guess + delta
+        while True:
+            value = self.search(depth, alpha, beta, mover)
+            if self.state.stopped:
+                return value
+            if value <= alpha and alpha > -INFINITY:
+                self.state.aspiration_fails += 1
+                delta *= 4
+                alpha = value - delta
+                if delta >= ASPIRATION_LIMIT:
+                    alpha = -INFINITY
+            elif value >= beta and beta < INFINITY:
+                self.state.aspiration_fails += 1
+                delta *= 4
+                beta = value + delta
+                if delta >= ASPIRATION_LIMIT:
+                    beta = INFINITY
+            else:
+                return value
+
+    def get_ordered_moves(self, pmoves, ply, mover, hash_move):
+        """ Lists the candidate moves, most promising first. """
+        if ply == 0 and self.state.root_move != NO_MOVE:
+            hash_move = self.state.root_move
+        orderer = self.state.orderer
+        if orderer is not None:
+            return orderer.order(self.board, pmoves, ply, mover, hash_move)
+        # raster order, but still try the hash move first.
+        moves = pmoves.to_list()
+        if hash_move != NO_MOVE and hash_move in moves:
+            moves.remove(hash_move)
+            moves.insert(0, hash_move)
+        return moves
+
+    def record_cutoff(self, move, depth, ply, mover):
+        self.state.cutoffs += 1
+        if self.state.orderer is not None:
+            self.state.orderer.record_cutoff(move, depth, ply, mover)
+
+    def iterative_deepening(self, max_depth, mover):
+        """ Searches depth 1, 2, ... up to max_depth, stopping when the
+            state's deadline passes or a stop is requested. The value and
+            self.move come from the last completed iteration; each
+            iteration tries the previous best move first.
+        """
+        state = self.state
+        state.root_move = NO_MOVE
+        state.completed_depth = 0
+        best_value = 0
+        depth = 1
+        while depth <= max_depth:
+            future = Future(self.board, self.player, state)
+            if state.algorithm == SEARCH_PVS and depth > 1:
+                value = future.aspiration_search(depth, best_value, mover)
+            elif state.algorithm == SEARCH_MTDF:
+                value = future.mtdf_search(depth, best_value, mover)
+            else:
+                value = future.search(depth, -INFINITY, INFINITY, mover)
+            if state.stopped:
+                break
+            state.completed_depth = depth
+            best_value = value
+            if future.move is None:
+                break # nothing to search, or the game is over.
+            self.move = future.move
+            state.root_move = pack_move(future.move[0], future.move[1])
+            depth += 1
+        state.root_move = NO_MOVE
+        if self.move is None:
+            # stopped before depth 1 finished -- any candidate will do.
+            pm_iter = self.board.get_possible_moves().get_iterator()
+            if pm_iter.has_next():
+                (x, y) = pm_iter.get_next()
+                self.move = [x, y]
+        return best_value
+
+    def get_packed_move(self):
+        if self.move is None:
+            return NO_MOVE
+        return pack_move(self.move[0], self.move[1])
+
     def naive_minimax(self, depth, mover):
         best_value = 0
         best_move = None
         if depth == 0:
             return self.heuristic_eval()
         elif mover is self.player: # max
-            saved_pmoves = self.board.get_possible_moves()
-            pm_iter = saved_pmoves.get_iterator()
+            pm_iter = self.board.get_possible_moves().get_iterator()
             while pm_iter.has_next():
                 (x, y) = pm_iter.get_next()
-                self.board.set_possible_moves(saved_pmoves.make_copy())
                 self.board.put_at(x, y, mover)
                 next_future = Future(self.board, self.player)
                 future_value = next_future.naive_minimax(
@@ -97,16 +807,13 @@ class Future(object):
                 if best_move is None or future_value > best_value:
                     best_value = future_value
                     best_move = [x, y]
-                self.board.del_at(x, y) # Restore the board.
-            self.board.set_possible_moves(saved_pmoves)
+                self.board.unmake_at(x, y) # Restore the board.
             self.move = best_move
             return best_value
         else: # min
-            saved_pmoves = self.board.get_possible_moves()
-            pm_iter = saved_pmoves.get_iterator()
+            pm_iter = self.board.get_possible_moves().get_iterator()
             while pm_iter.has_next():
                 (x, y) = pm_iter.get_next()
-                self.board.set_possible_moves(saved_pmoves.make_copy())
                 self.board.put_at(x, y, mover)
                 next_future = Future(self.board, self.player)
                 future_value = next_future.naive_minimax(
@@ -114,8 +821,7 @@ class Future(object):
                 if best_move is None or future_value < best_value:
                     best_value = future_value
                     best_move = [x, y]
-                self.board.del_at(x, y) # Restore the board.
-            self.board.set_possible_moves(saved_pmoves)
+                self.board.unmake_at(x, y) # Restore the board.
             self.move = best_move
             return best_value
 
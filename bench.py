@@ -0,0 +1,399 @@
+""" bench.py
+
+    Search benchmarks over a fixed set of positions, for comparing the
+    search variants with each other. Usage:
+
+        python bench.py <benchmark> [depth]
+
+    Every benchmark prints one line per configuration with the total
+    node count, the time taken and the resulting nodes per second.
+"""
+
+from time import time
+
+from board import Board
+from bitboard import BitBoard
+from model import circle, cross, BOARD_SIZE, TranspositionTable
+from ai import (Future, SearchState, INFINITY, MAX_SEARCH_DEPTH,
+                SEARCH_NAMES)
+from ordering import MoveOrderer
+from patterns import PatternEvaluator
+import npeval
+
+# (x, y, pid) triples, circle (pid 0) moves first. The side to move is
+# the player with fewer stones.
+POSITIONS = [
+    [(9, 9, 0), (10, 10, 1), (9, 10, 0), (10, 9, 1), (8, 11, 0),
+     (11, 8, 1), (9, 8, 0)],
+    [(9, 9, 0), (10, 9, 1), (9, 10, 0), (9, 8, 1), (10, 11, 0),
+     (8, 10, 1), (11, 12, 0), (12, 13, 1)],
+    [(5, 5, 0), (6, 6, 1), (6, 5, 0), (7, 5, 1), (5, 6, 0), (5, 7, 1),
+     (4, 4, 0), (3, 3, 1), (7, 7, 0)],
+    [(12, 3, 0), (12, 4, 1), (13, 3, 0), (11, 3, 1), (13, 4, 0),
+     (14, 5, 1), (12, 5, 0), (11, 6, 1)],
+]
+
+PLAYERS = [circle, cross]
+
+def make_board(position, board_class=Board, evaluator=None, size=BOARD_SIZE):
+    board = board_class(size)
+    if evaluator is not None:
+        board.set_evaluator(evaluator)
+    for (x, y, pid) in position:
+        board.put_at(x, y, PLAYERS[pid])
+    return board
+
+def side_to_move(position):
+    return PLAYERS[len(position) % 2]
+
+def run_alphabeta(position, depth, state, board_class=Board):
+    board = make_board(position, board_class)
+    player = side_to_move(position)
+    future = Future(board, player, state)
+    state.new_search()
+    return future.alphabeta(depth, -INFINITY, INFINITY, player)
+
+def report(name, nodes, elapsed):
+    nps = 0
+    if elapsed > 0:
+        nps = int(nodes / elapsed)
+    print '%-24s %10d nodes %8.2fs %9d nodes/s' % (name, nodes, elapsed, nps)
+
+def bench_configs(depth, configs, board_class=Board):
+    for (name, make_state) in configs:
+        nodes = 0
+        start = time()
+        for position in POSITIONS:
+            state = make_state()
+            run_alphabeta(position, depth, state, board_class)
+            nodes += state.nodes
+        report(name, nodes, time() - start)
+
+def bench_ordering(depth):
+    bench_configs(depth, [
+        ('raster', lambda: SearchState()),
+        ('tt', lambda: SearchState(TranspositionTable())),
+        ('tt+ordering', lambda: SearchState(TranspositionTable(),
+                                            MoveOrderer())),
+        ('tt+ordering-no-static', lambda: SearchState(
+                TranspositionTable(), MoveOrderer(use_static=False))),
+    ])
+
+def bench_boards(depth):
+    for (name, board_class) in [('board', Board), ('bitboard', BitBoard)]:
+        bench_configs(depth, [
+            (name, lambda: SearchState()),
+            (name + '+tt+ordering', lambda: SearchState(
+                    TranspositionTable(), MoveOrderer())),
+        ], board_class)
+
+def bench_evaluators(depth):
+    evaluators = [('groups', lambda: None), ('pattern', PatternEvaluator)]
+    if npeval.numpy is not None:
+        evaluators.append(('numpy', npeval.NumpyEvaluator))
+    for (name, make_evaluator) in evaluators:
+        nodes = 0
+        start = time()
+        for position in POSITIONS:
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            board = make_board(position, Board, make_evaluator())
+            player = side_to_move(position)
+            state.new_search()
+            Future(board, player, state).alphabeta(depth, -INFINITY,
+                                                   INFINITY, player)
+            nodes += state.nodes
+        report(name, nodes, time() - start)
+
+def bench_journal(depth):
+    for use_journal in (False, True):
+        nodes = 0
+        start = time()
+        for position in POSITIONS:
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            board = Board()
+            board.use_journal = use_journal
+            for (x, y, pid) in position:
+                board.put_at(x, y, PLAYERS[pid])
+            player = side_to_move(position)
+            state.new_search()
+            Future(board, player, state).alphabeta(depth, -INFINITY,
+                                                   INFINITY, player)
+            nodes += state.nodes
+        if use_journal:
+            report('journal', nodes, time() - start)
+        else:
+            report('remove', nodes, time() - start)
+
+def bench_sizes(depth):
+    # the positions are shifted to the middle of each board, so only the
+    # board size changes between runs.
+    for size in (15, 19, 31, 51):
+        shift = size // 2 - 9
+        for board_class in (Board, BitBoard):
+            nodes = 0
+            start = time()
+            for position in POSITIONS:
+                moved = [(x + shift, y + shift, pid)
+                         for (x, y, pid) in position]
+                board = make_board(moved, board_class, size=size)
+                state = SearchState(TranspositionTable(), MoveOrderer())
+                player = side_to_move(position)
+                state.new_search()
+                Future(board, player, state).alphabeta(depth, -INFINITY,
+                                                       INFINITY, player)
+                nodes += state.nodes
+            report('%s %dx%d' % (board_class.__name__.lower(), size, size),
+                   nodes, time() - start)
+
+def bench_search(depth):
+    """ Each algorithm at a fixed depth with the full window, then under
+        iterative deepening (where PVS uses aspiration windows and MTD(f)
+        starts from the previous iteration's value).
+    """
+    for deepening in (False, True):
+        for algorithm in xrange(len(SEARCH_NAMES)):
+            nodes = 0
+            extra = 0
+            start = time()
+            for position in POSITIONS:
+                board = make_board(position)
+                player = side_to_move(position)
+                state = SearchState(TranspositionTable(), MoveOrderer())
+                state.algorithm = algorithm
+                state.new_search()
+                future = Future(board, player, state)
+                if deepening:
+                    future.iterative_deepening(depth, player)
+                else:
+                    future.search(depth, -INFINITY, INFINITY, player)
+                nodes += state.nodes
+                extra += (state.researches + state.aspiration_fails +
+                          state.passes)
+            name = SEARCH_NAMES[algorithm]
+            if deepening:
+                name += ' (deepening)'
+            report(name, nodes, time() - start)
+            if extra:
+                print '    %d re-searches / failed windows / passes' % extra
+
+# Positions with a forced win for the side to move, for bench_pns.
+WIN_POSITIONS = [
+    [(4, 5, 0), (3, 5, 1), (5, 5, 0), (7, 10, 1), (6, 5, 0), (10, 10, 1),
+     (7, 7, 0), (11, 11, 1), (7, 8, 0), (12, 12, 1), (7, 9, 0), (2, 2, 1)],
+    [(5, 5, 0), (10, 10, 1), (6, 5, 0), (11, 12, 1), (7, 6, 0),
+     (2, 14, 1), (7, 7, 0), (14, 2, 1)],
+]
+
+def bench_pns(depth):
+    """ Proof-number search on the fixed positions and on some won ones,
+        then alpha-beta at the given depth on the same positions.
+    """
+    from pns import ProofNumberSearch, PNS_STATUS_NAMES
+    positions = POSITIONS + WIN_POSITIONS
+    solver = ProofNumberSearch()
+    nodes = 0
+    start = time()
+    statuses = []
+    for position in positions:
+        board = make_board(position)
+        statuses.append(PNS_STATUS_NAMES[
+                solver.solve(board, side_to_move(position))])
+        nodes += solver.nodes
+    report('df-pn', nodes, time() - start)
+    print '    %s' % ', '.join(statuses)
+    nodes = 0
+    start = time()
+    for position in positions:
+        state = SearchState(TranspositionTable(), MoveOrderer())
+        run_alphabeta(position, depth, state)
+        nodes += state.nodes
+    report('alphabeta', nodes, time() - start)
+
+def bench_quiescence(depth):
+    for use_quiescence in (False, True):
+        nodes = 0
+        qnodes = 0
+        start = time()
+        for position in POSITIONS:
+            board = make_board(position)
+            player = side_to_move(position)
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            state.use_quiescence = use_quiescence
+            state.new_search()
+            Future(board, player, state).alphabeta(depth, -INFINITY,
+                                                   INFINITY, player)
+            nodes += state.nodes
+            qnodes += state.qnodes
+        if use_quiescence:
+            report('quiescence', nodes, time() - start)
+            print '    %d quiescence nodes' % qnodes
+        else:
+            report('horizon', nodes, time() - start)
+
+def bench_extensions(depth):
+    for use_extensions in (False, True):
+        nodes = 0
+        extensions = 0
+        start = time()
+        for position in POSITIONS:
+            board = make_board(position)
+            player = side_to_move(position)
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            state.use_extensions = use_extensions
+            state.new_search()
+            Future(board, player, state).alphabeta(depth, -INFINITY,
+                                                   INFINITY, player)
+            nodes += state.nodes
+            extensions += state.extensions
+        if use_extensions:
+            report('extensions', nodes, time() - start)
+            print '    %d moves extended' % extensions
+        else:
+            report('fixed depth', nodes, time() - start)
+
+# Milliseconds per position for the equal-time runs of bench_pruning.
+PRUNING_MOVE_TIME = 2000
+
+def bench_pruning(depth):
+    """ Null-move pruning and late move reductions, each alone and both,
+        at a fixed depth and then at equal time, where the depth reached
+        is what counts.
+    """
+    configs = [('full-width', False, False), ('null-move', True, False),
+               ('lmr', False, True), ('null-move+lmr', True, True)]
+    for (name, use_null_move, use_lmr) in configs:
+        nodes = 0
+        extra = [0, 0, 0, 0]
+        start = time()
+        for position in POSITIONS:
+            board = make_board(position)
+            player = side_to_move(position)
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            state.use_null_move = use_null_move
+            state.use_lmr = use_lmr
+            state.new_search()
+            Future(board, player, state).alphabeta(depth, -INFINITY,
+                                                   INFINITY, player)
+            nodes += state.nodes
+            extra[0] += state.null_probes
+            extra[1] += state.null_cutoffs
+            extra[2] += state.reductions
+            extra[3] += state.reduction_researches
+        report(name, nodes, time() - start)
+        print ('    %d/%d null-move cutoffs, %d/%d reductions searched '
+               'again' % (extra[1], extra[0], extra[3], extra[2]))
+    for (name, use_null_move, use_lmr) in configs:
+        depths = []
+        for position in POSITIONS:
+            board = make_board(position)
+            player = side_to_move(position)
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            state.use_null_move = use_null_move
+            state.use_lmr = use_lmr
+            state.new_search()
+            state.start_timer(PRUNING_MOVE_TIME)
+            Future(board, player, state).iterative_deepening(
+                    MAX_SEARCH_DEPTH, player)
+            depths.append(state.completed_depth)
+        print '%-24s depths %s in %.1fs each' % (
+                name, ' '.join([str(d) for d in depths]),
+                PRUNING_MOVE_TIME / 1000.0)
+
+def bench_mcts(depth):
+    """ MCTS playouts per second, 100 * depth iterations a position, on
+        each board.
+    """
+    from mcts import MCTSSearch
+    for board_class in (Board, BitBoard):
+        playouts = 0
+        start = time()
+        for position in POSITIONS:
+            board = make_board(position, board_class)
+            searcher = MCTSSearch(100 * depth)
+            searcher.search(board, side_to_move(position))
+            playouts += searcher.playouts
+        elapsed = time() - start
+        print '%-24s %10d playouts %8.2fs %9d playouts/s' % (
+                'mcts ' + board_class.__name__.lower(), playouts, elapsed,
+                int(playouts / elapsed))
+
+def bench_parallel(depth):
+    from parallel import RootParallelSearch
+    bench_configs(depth, [
+        ('sequential', lambda: SearchState(TranspositionTable(),
+                                           MoveOrderer())),
+    ])
+    cores = 1
+    while cores <= 8:
+        searcher = RootParallelSearch(cores)
+        nodes = 0
+        start = time()
+        for position in POSITIONS:
+            board = make_board(position)
+            searcher.search(board, side_to_move(position), depth)
+            nodes += searcher.nodes
+        report('root-parallel x%d' % cores, nodes, time() - start)
+        searcher.close()
+        cores *= 2
+
+def bench_smp(depth):
+    from smp import LazySMPSearch
+    for threads in (1, 2, 4):
+        nodes = 0
+        start = time()
+        for position in POSITIONS:
+            board = make_board(position)
+            searcher = LazySMPSearch(threads)
+            searcher.search(board, side_to_move(position), depth)
+            nodes += searcher.state.nodes
+        report('lazy-smp x%d (main)' % threads, nodes, time() - start)
+
+def bench_threats(depth):
+    """ The threat-space solver on every position, for the side to move.
+        depth is the VCT depth; VCF goes twice as deep.
+    """
+    from threats import ThreatSolver
+    solver = ThreatSolver(2 * depth, depth)
+    nodes = 0
+    wins = 0
+    start = time()
+    for position in POSITIONS:
+        board = make_board(position)
+        if solver.solve(board, side_to_move(position)) is not None:
+            wins += 1
+        nodes += solver.nodes
+    report('threats (%d wins)' % wins, nodes, time() - start)
+
+BENCHMARKS = {
+    'ordering': bench_ordering,
+    'boards': bench_boards,
+    'evaluators': bench_evaluators,
+    'extensions': bench_extensions,
+    'journal': bench_journal,
+    'mcts': bench_mcts,
+    'parallel': bench_parallel,
+    'pns': bench_pns,
+    'pruning': bench_pruning,
+    'quiescence': bench_quiescence,
+    'sizes': bench_sizes,
+    'search': bench_search,
+    'smp': bench_smp,
+    'threats': bench_threats,
+}
+
+def main(argv):
+    try:
+        bench = BENCHMARKS[argv[1]]
+    except (IndexError, KeyError):
+        print 'usage: bench.py <%s> [depth]' % '|'.join(sorted(BENCHMARKS))
+        return 1
+    try:
+        depth = int(argv[2])
+    except (IndexError, ValueError):
+        depth = 3
+    bench(depth)
+    return 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main(sys.argv))
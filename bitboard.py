@@ -0,0 +1,214 @@
+""" bitboard.py
+
+    An alternative board engine that stores pieces as bitmasks instead of
+    Piece/PieceGroup objects.
+
+    Every player owns one bitmask per line of the board: rows, columns
+    and the two diagonal directions. Bit x of a line is set if the player
+    has a piece on that line at column x (rows use x, columns use y).
+    Placing or removing a piece flips one bit in each of the four lines
+    through it, and only those four lines get re-scored.
+
+    Scoring follows pieces.PieceGroup.heuristic_eval: every maximal run
+    of two or more pieces counts HVALTAB2[blockage][length], where an end
+    is blocked if it's off the board or taken. Runs are found with the
+    carry trick -- adding a run's lowest bit to the mask clears the run
+    and sets the bit right after it.
+"""
+
+from board import BoardBase
+from model import BOARD_SIZE, PLAYER_COUNT, Player, BIT_INDEX, lowest_bit
+from pieces import (HVALTAB2, DIR_HORIZONTAL, DIR_VERTICAL,
+                    DIR_DIAGONAL_DOWN, DIR_DIAGONAL_UP)
+
+MAX_RUN_LENGTH = len(HVALTAB2[0]) - 1
+LINE_KINDS = 4
+
+def score_line(mask, occupied, valid):
+    """ Returns (hval, fives) for the runs in one line of one player. """
+    hval = 0
+    fives = 0
+    runs = mask
+    while runs:
+        low = lowest_bit(runs)
+        after = lowest_bit(runs + low) # first bit past the run.
+        length = BIT_INDEX[after] - BIT_INDEX[low]
+        runs &= ~(after - low)
+        if length < 2:
+            continue
+        if length == 5:
+            fives += 1
+        hval += score_run(low, after, occupied, valid)
+    return hval, fives
+
+def score_run(low, after, occupied, valid):
+    """ HVALTAB2 value of a run of two or more from bit low up to (not
+        including) bit after.
+    """
+    length = BIT_INDEX[after] - BIT_INDEX[low]
+    blockage = 0
+    before = low >> 1
+    if not before or not (valid & before) or (occupied & before):
+        blockage += 1
+    if not (valid & after) or (occupied & after):
+        blockage += 1
+    if length > MAX_RUN_LENGTH:
+        length = MAX_RUN_LENGTH
+    return HVALTAB2[blockage][length]
+
+def get_run(mask, bit):
+    """ Returns (low, after): the lowest bit of the run of mask through
+        bit, and the bit right after the run. low == after if bit isn't
+        set in mask.
+    """
+    low = bit
+    if mask & bit:
+        while mask & (low >> 1):
+            low >>= 1
+    after = bit
+    while mask & after:
+        after <<= 1
+    return low, after
+
+class BitBoard(BoardBase):
+    def __init__(self, size=BOARD_SIZE):
+        BoardBase.__init__(self, size) # workaround.
+        nb_diagonals = 2 * size - 1
+        self.line_counts = [0] * LINE_KINDS
+        self.line_counts[DIR_HORIZONTAL] = size
+        self.line_counts[DIR_VERTICAL] = size
+        self.line_counts[DIR_DIAGONAL_DOWN] = nb_diagonals
+        self.line_counts[DIR_DIAGONAL_UP] = nb_diagonals
+        # lines[kind][pid][index] -> bitmask
+        self.lines = [[[0] * self.line_counts[kind]
+                       for _ in xrange(PLAYER_COUNT)]
+                      for kind in xrange(LINE_KINDS)]
+        # cells that exist on each line, the rest counts as blocked.
+        self.valid = [[0] * self.line_counts[kind]
+                      for kind in xrange(LINE_KINDS)]
+        # cached per-line scores, and their per-player sums.
+        self.line_hvals = [[[0] * self.line_counts[kind]
+                            for _ in xrange(PLAYER_COUNT)]
+                           for kind in xrange(LINE_KINDS)]
+        self.line_fives = [[[0] * self.line_counts[kind]
+                            for _ in xrange(PLAYER_COUNT)]
+                           for kind in xrange(LINE_KINDS)]
+        self.hvals = [0] * PLAYER_COUNT
+        self.fives = [0] * PLAYER_COUNT
+        # all players' pieces per row, for the emptiness tests.
+        self.occupied_rows = [0] * size
+        for y in xrange(size):
+            for x in xrange(size):
+                for kind in xrange(LINE_KINDS):
+                    self.valid[kind][self.line_index(kind, x, y)] |= (
+                            self.line_bit(kind, x, y))
+
+    def __repr__(self):
+        return '<bitboard>'
+
+    def line_index(self, kind, x, y):
+        if kind == DIR_HORIZONTAL:
+            return y
+        elif kind == DIR_VERTICAL:
+            return x
+        elif kind == DIR_DIAGONAL_DOWN:
+            return x - y + self.size - 1
+        else:
+            return x + y
+
+    def line_bit(self, kind, x, y):
+        if kind == DIR_VERTICAL:
+            return 1 << y
+        return 1 << x
+
+    def get_owner_at(self, x, y):
+        if not self.pos_is_valid(x, y) or self.is_empty(x, y):
+            return None
+        bit = 1 << x
+        for pid in xrange(PLAYER_COUNT):
+            if self.lines[DIR_HORIZONTAL][pid][y] & bit:
+                return Player.cache[pid]
+        return None
+
+    def is_empty(self, x, y):
+        if not self.pos_is_valid(x, y):
+            return False
+        return not (self.occupied_rows[y] & (1 << x))
+
+    def put_at(self, x, y, player):
+        for kind in xrange(LINE_KINDS):
+            index = self.line_index(kind, x, y)
+            self.lines[kind][player.pid][index] |= self.line_bit(kind, x, y)
+            self.rescore_line(kind, index)
+        self.occupied_rows[y] |= 1 << x
+        self.hash ^= self.zobrist_keys[player.pid][y][x]
+        self.push_history(x, y)
+        self.notify_evaluator(x, y)
+        self.add_possible_move(x, y)
+
+    def del_at(self, x, y):
+        owner = self.get_owner_at(x, y)
+        for kind in xrange(LINE_KINDS):
+            index = self.line_index(kind, x, y)
+            self.lines[kind][owner.pid][index] &= ~self.line_bit(kind, x, y)
+            self.rescore_line(kind, index)
+        self.occupied_rows[y] &= ~(1 << x)
+        self.hash ^= self.zobrist_keys[owner.pid][y][x]
+        self.notify_evaluator(x, y)
+        self.pop_history(x, y)
+
+    def rescore_line(self, kind, index):
+        masks = self.lines[kind]
+        occupied = 0
+        for pid in xrange(PLAYER_COUNT):
+            occupied |= masks[pid][index]
+        valid = self.valid[kind][index]
+        for pid in xrange(PLAYER_COUNT):
+            hval, fives = score_line(masks[pid][index], occupied, valid)
+            self.hvals[pid] += hval - self.line_hvals[kind][pid][index]
+            self.fives[pid] += fives - self.line_fives[kind][pid][index]
+            self.line_hvals[kind][pid][index] = hval
+            self.line_fives[kind][pid][index] = fives
+
+    def get_run_hval_at(self, x, y):
+        owner = self.get_owner_at(x, y)
+        best = 0
+        for kind in xrange(LINE_KINDS):
+            index = self.line_index(kind, x, y)
+            (low, after) = get_run(self.lines[kind][owner.pid][index],
+                                   self.line_bit(kind, x, y))
+            if BIT_INDEX[after] - BIT_INDEX[low] < 2:
+                continue
+            occupied = 0
+            for pid in xrange(PLAYER_COUNT):
+                occupied |= self.lines[kind][pid][index]
+            hval = score_run(low, after, occupied, self.valid[kind][index])
+            if hval > best:
+                best = hval
+        return best
+
+    def get_hval(self, pid):
+        if self.evaluator is not None:
+            return self.evaluator.get_hval(pid)
+        return self.hvals[pid]
+
+    def has_five(self, pid):
+        return self.fives[pid] != 0
+
+    def is_win_at(self, x, y):
+        owner = self.get_owner_at(x, y)
+        if owner is None:
+            return False
+        return self.has_five_through(x, y, owner.pid)
+
+    def has_five_through(self, x, y, pid):
+        """ Whether (x, y) is in a run of five (or more) of pid's on one
+            of the lines through it. Other runs on those lines don't count.
+        """
+        for kind in xrange(LINE_KINDS):
+            index = self.line_index(kind, x, y)
+            (low, after) = get_run(self.lines[kind][pid][index],
+                                   self.line_bit(kind, x, y))
+            if BIT_INDEX[after] - BIT_INDEX[low] >= 5:
+                return True
+        return False
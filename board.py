@@ -3,73 +3,309 @@
     Contains the central object of Gomoku game -- the board.
 """
 
-from model import (BOARD_SIZE, SmallSet, PLAYER_COUNT, make_chess_space,
-                   make_neighbours, make_larger_neighbours)
-from pieces import Piece, merge_dual, PieceGroupManager, HVALTAB
-
-class Board(object):
-    def __init__(self):
-        self.size = BOARD_SIZE
-        self.space = make_chess_space(19)
+from model import (BOARD_SIZE, SmallSet, PLAYER_COUNT, NO_MOVE,
+                   make_chess_space, get_neighbour_table, get_zobrist_keys,
+                   pack_move, unpack_move_x, unpack_move_y)
+from pieces import (Piece, merge_dual, refresh_blocked_groups,
+                    undo_group_change, PieceGroupManager, HVALTAB,
+                    DIRECTION_STEPS)
+
+class BoardBase(object):
+    """ What the search needs from any board representation: the
+        candidate moves and the zobrist hash, both kept incrementally.
+        Subclasses implement put_at, del_at, is_empty, get_owner_at,
+        get_hval, has_five and is_win_at, and keep the move history with
+        push_history/pop_history.
+
+        put_at logs the candidate move bits it changes, so unmake_at()
+        can undo a move without copying the candidate set. Moves must be
+        unmade in the reverse order they were made. A plain del_at folds
+        the piece's log entries into the move put before it, so they are
+        undone with that one; pm_marks always has one entry per piece in
+        history.
+
+        An optional evaluator (see patterns.py) replaces the board's own
+        heuristic values; the subclasses call notify_evaluator() once a
+        cell has changed.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.possible_moves = SmallSet(self.size)
+        # cells around each cell that become candidate moves.
+        self.neighbours = get_neighbour_table(size, 2)
+        #self.neighbours = get_neighbour_table(size, 3)
+        # zobrist hash of the pieces on board, updated incrementally.
+        self.zobrist_keys = get_zobrist_keys(size)
+        self.hash = 0
+        self.evaluator = None
+        # undo log of possible_moves: one entry per changed bit, the
+        # packed cell shifted left once with the low bit set if the bit
+        # was added. pm_marks holds the log length before each put_at.
+        self.pm_log = []
+        self.pm_marks = []
+        # packed positions of the pieces, in the order they were put.
+        self.history = []
+
+    def set_evaluator(self, evaluator):
+        self.evaluator = evaluator
+        if evaluator is not None:
+            evaluator.attach(self)
+
+    def notify_evaluator(self, x, y):
+        if self.evaluator is not None:
+            self.evaluator.update_at(self, x, y)
+
+    def push_history(self, x, y):
+        self.history.append(pack_move(x, y))
+
+    def pop_history(self, x, y):
+        move = pack_move(x, y)
+        history = self.history
+        if history[-1] == move:
+            index = len(history) - 1
+        else:
+            index = history.index(move)
+        del history[index]
+        del self.pm_marks[index]
+
+    def get_last_move(self):
+        if not self.history:
+            return NO_MOVE
+        return self.history[-1]
+
+    def is_win_at(self, x, y):
+        """ Whether the piece at (x, y) is part of five or more in a
+            row.
+        """
+        raise NotImplementedError
+
+    def get_run_hval_at(self, x, y):
+        """ The largest heuristic value (see PieceGroup.heuristic_eval)
+            of the runs through the piece at (x, y), 0 if it's in none.
+        """
+        raise NotImplementedError
+
+    def last_move_wins(self):
+        """ Whether the last piece put won the game -- the only way a
+            game that wasn't over can have become over.
+        """
+        move = self.get_last_move()
+        if move == NO_MOVE:
+            return False
+        return self.is_win_at(unpack_move_x(move), unpack_move_y(move))
+
+    def pos_is_valid(self, x, y):
+        return 0 <= x < self.size and 0 <= y < self.size
+
+    def get_hash(self):
+        return self.hash
+
+    def get_stones(self):
+        """ Lists the pieces on board as (x, y, pid) triples. """
+        stones = []
+        for y in xrange(self.size):
+            for x in xrange(self.size):
+                owner = self.get_owner_at(x, y)
+                if owner is not None:
+                    stones.append((x, y, owner.pid))
+        return stones
+
+    def add_possible_move(self, x, y):
+        pm = self.possible_moves
+        log = self.pm_log
+        self.pm_marks.append(len(log))
+        if pm.get_at(x, y):
+            pm.del_at(x, y)
+            log.append(((y << 8) | x) << 1)
+        for (nx, ny) in self.neighbours[y][x]:
+            if self.is_empty(nx, ny) and not pm.get_at(nx, ny):
+                pm.put_at(nx, ny)
+                log.append((((ny << 8) | nx) << 1) | 1)
+
+    def undo_possible_moves(self, mark):
+        """ Reverts the candidate move changes logged since mark. """
+        pm = self.possible_moves
+        log = self.pm_log
+        while len(log) > mark:
+            entry = log.pop()
+            cell = entry >> 1
+            if entry & 1:
+                pm.del_at(cell & 0xff, cell >> 8)
+            else:
+                pm.put_at(cell & 0xff, cell >> 8)
+
+    def unmake_at(self, x, y):
+        """ Takes back the last put_at, which was at (x, y). """
+        mark = self.pm_marks[-1]
+        self.del_at(x, y)
+        self.undo_possible_moves(mark)
+
+    def get_possible_moves(self):
+        return self.possible_moves
+
+    def set_possible_moves(self, pmoves):
+        self.possible_moves = pmoves
+
+class Board(BoardBase):
+    """ Board of Piece objects, with the pieces of each player gathered
+        into line groups (see pieces.py).
+
+        put_at journals the group changes it makes. A del_at of the last
+        piece put replays that journal backwards, which restores the old
+        groups as they were; any other del_at splits the groups with
+        PieceGroup.remove() and drops the journal.
+    """
+    def __init__(self, size=BOARD_SIZE):
+        BoardBase.__init__(self, size) # workaround.
+        self.space = make_chess_space(self.size)
         # owning piece-groups for each player.
         self.piece_groups = [PieceGroupManager(len(HVALTAB) - 1)
                              for _ in xrange(PLAYER_COUNT)]
-        self.possible_moves = SmallSet(self.size)
+        # journal of group changes, one entry across the three lists.
+        self.use_journal = True
+        self.group_log_changes = []
+        self.group_log_groups = []
+        self.group_log_values = []
+        # journal length before each put_at, and the packed position.
+        self.group_marks = []
+        self.group_mark_moves = []
 
     def __repr__(self):
         return '<board>'
 
-    def pos_is_valid(self, x, y):
-        return 0 <= x < self.size and 0 <= y < self.size
-
     def get_at(self, x, y):
         if self.pos_is_valid(x, y):
             return self.space[y][x]
         else:
             return None
 
+    def is_empty(self, x, y):
+        return self.pos_is_valid(x, y) and self.space[y][x] is None
+
+    def get_owner_at(self, x, y):
+        piece = self.get_at(x, y)
+        if piece:
+            return piece.owner
+        return None
+
     def del_at(self, x, y):
         piece = self.get_at(x, y)
         self.space[y][x] = None
-        for group in piece.groups:
-            group.remove(self, piece)
+        self.hash ^= self.zobrist_keys[piece.owner.pid][y][x]
+        if self.group_marks and self.group_mark_moves[-1] == (y << 8) | x:
+            self.undo_group_changes()
+        else:
+            self.clear_group_log()
+            for group in piece.groups:
+                group.remove(self, piece)
+        refresh_blocked_groups(self, x, y, piece.owner)
+        self.notify_evaluator(x, y)
+        self.pop_history(x, y)
 
     def put_at(self, x, y, player):
         piece = Piece(x, y, player)
         self.space[y][x] = piece
+        self.hash ^= self.zobrist_keys[player.pid][y][x]
+        self.push_history(x, y)
+        if self.use_journal:
+            self.group_marks.append(len(self.group_log_changes))
+            self.group_mark_moves.append((y << 8) | x)
         for neighbour in self.find_mergeable_neighbours(piece):
             merge_dual(self, piece, neighbour)
+        refresh_blocked_groups(self, x, y, player)
+        self.notify_evaluator(x, y)
         self.add_possible_move(x, y)
         return piece
 
+    def log_group_change(self, change, group, value):
+        if self.use_journal:
+            self.group_log_changes.append(change)
+            self.group_log_groups.append(group)
+            self.group_log_values.append(value)
+
+    def undo_group_changes(self):
+        """ Reverts the group changes of the last put_at. """
+        mark = self.group_marks.pop()
+        self.group_mark_moves.pop()
+        changes = self.group_log_changes
+        groups = self.group_log_groups
+        values = self.group_log_values
+        while len(changes) > mark:
+            undo_group_change(self, changes.pop(), groups.pop(),
+                              values.pop())
+
+    def clear_group_log(self):
+        del self.group_log_changes[:]
+        del self.group_log_groups[:]
+        del self.group_log_values[:]
+        del self.group_marks[:]
+        del self.group_mark_moves[:]
+
     def add_piece_group(self, group):
+        group.hval = group.heuristic_eval(self)
         self.piece_groups[group.get_owner().pid].put(group)
 
+    def refresh_piece_group(self, group):
+        self.piece_groups[group.get_owner().pid].refresh(
+                group, group.heuristic_eval(self))
+
     def del_piece_group(self, group):
         self.piece_groups[group.get_owner().pid].remove(group)
 
     def get_piece_groups(self):
         return self.piece_groups
 
-    def add_possible_move(self, x, y):
-        pm = self.possible_moves
-        pm.del_at(x, y)
-        for (nx, ny) in make_neighbours(x, y):
-        #for (nx, ny) in make_larger_neighbours(x, y):
-            if self.get_at(nx, ny) is None:
-                pm.put_at(nx, ny)
+    def get_hval(self, pid):
+        """ The sum of pid's group heuristic values, kept incrementally. """
+        if self.evaluator is not None:
+            return self.evaluator.get_hval(pid)
+        return self.piece_groups[pid].get_hval()
 
-    def get_possible_moves(self):
-        return self.possible_moves
+    def has_five(self, pid):
+        return self.piece_groups[pid].count_of(5) != 0
 
-    def set_possible_moves(self, pmoves):
-        self.possible_moves = pmoves
+    def get_run_hval_at(self, x, y):
+        best = 0
+        for group in self.get_at(x, y).groups:
+            hval = group.heuristic_eval(self)
+            if hval > best:
+                best = hval
+        return best
+
+    def is_win_at(self, x, y):
+        piece = self.get_at(x, y)
+        if piece is None:
+            return False
+        owner = piece.owner
+        space = self.space
+        for (dx, dy) in DIRECTION_STEPS:
+            count = 1
+            nx = x + dx
+            ny = y + dy
+            while self.pos_is_valid(nx, ny):
+                other = space[ny][nx]
+                if other is None or other.owner is not owner:
+                    break
+                count += 1
+                nx += dx
+                ny += dy
+            nx = x - dx
+            ny = y - dy
+            while self.pos_is_valid(nx, ny):
+                other = space[ny][nx]
+                if other is None or other.owner is not owner:
+                    break
+                count += 1
+                nx -= dx
+                ny -= dy
+            if count >= 5:
+                return True
+        return False
 
     def find_mergeable_neighbours(self, piece):
         res = []
-        for (nx, ny) in make_neighbours(piece.x, piece.y):
+        for (nx, ny) in self.neighbours[piece.y][piece.x]:
             neighbour = self.get_at(nx, ny)
             if neighbour and neighbour.owner is piece.owner:
                 res.append(neighbour)
         return res
-
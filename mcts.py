@@ -0,0 +1,275 @@
+""" mcts.py
+
+    Monte Carlo tree search (UCT), an engine beside the alpha-beta
+    search of ai.py.
+
+    Every iteration walks down the tree by UCB1, adds one node, plays a
+    lightly weighted random game from there and counts the result on the
+    way back up. The playouts complete a five when they can and block
+    the other side's four when they must, and are otherwise uniformly
+    random over the candidate moves; one that runs past ROLLOUT_LIMIT
+    moves goes to the side with the larger heuristic value.
+
+    Moves are played on the board itself and taken back with unmake_at,
+    so a search leaves the board as it found it. The tree is kept
+    between the moves of a game: the next search starts from the node of
+    the position reached, if the moves played since are in the tree.
+"""
+
+from math import log, sqrt
+from time import time
+
+from model import (PLAYER_COUNT, Player, ZobristRandom, NO_MOVE, pack_move,
+                   unpack_move_x, unpack_move_y)
+from threats import get_five_cells, get_recent_five_cells
+
+MCTS_ITERATIONS = 1000
+# UCB1 exploration constant, sqrt(2) in theory; lower suits the few
+# iterations a move gets here.
+UCT_EXPLORATION = 1.0
+ROLLOUT_LIMIT = 60
+# Random cells a playout tries before listing the candidate moves.
+RANDOM_CELL_TRIES = 8
+# How many iterations to run between two looks at the clock.
+MCTS_TIME_CHECK_INTERVAL = 16
+MCTS_SEED = 0x5eed
+
+class MCTSNode(object):
+    """ A position in the tree, reached by pid playing move. score holds
+        pid's results from the playouts through here, 1 per win and 0.5
+        per draw.
+    """
+    __slots__ = ('move', 'pid', 'parent', 'children', 'untried', 'visits',
+                 'score', 'terminal')
+
+    def __init__(self, move, pid, parent, untried, terminal):
+        self.move = move
+        self.pid = pid
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.score = 0.0
+        self.terminal = terminal
+
+    def select_child(self, exploration):
+        """ The child with the best UCB1 value, or one that just won. """
+        log_visits = log(self.visits)
+        best = None
+        best_value = -1.0
+        for child in self.children:
+            if child.terminal:
+                return child
+            value = (child.score / child.visits +
+                     exploration * sqrt(log_visits / child.visits))
+            if value > best_value:
+                best_value = value
+                best = child
+        return best
+
+    def find_child(self, move):
+        for child in self.children:
+            if child.move == move:
+                return child
+        return None
+
+    def get_most_visited(self):
+        """ The child played most often, or one that just won. """
+        best = None
+        for child in self.children:
+            if child.terminal:
+                return child
+            if best is None or child.visits > best.visits:
+                best = child
+        return best
+
+class MCTSSearch(object):
+    """ UCT searcher for one player's moves. search() runs up to
+        `iterations` iterations, and stops early after move_time
+        milliseconds if given.
+    """
+    def __init__(self, iterations=MCTS_ITERATIONS,
+                 exploration=UCT_EXPLORATION, seed=MCTS_SEED):
+        self.iterations = iterations
+        self.exploration = exploration
+        self.rand = ZobristRandom(seed)
+        self.root = None
+        # board.history when the root was the position on the board.
+        self.root_history = []
+        self.move = None
+        self.playouts = 0
+        # iterations the root had from earlier searches.
+        self.reused_visits = 0
+        self.start_time = time()
+        self.elapsed = 0.0
+
+    def get_playouts_per_second(self):
+        if self.elapsed <= 0.0:
+            return 0.0
+        return self.playouts / self.elapsed
+
+    def random_index(self, count):
+        return self.rand.next_31() % count
+
+    def make_node(self, board, move, pid, parent):
+        terminal = board.last_move_wins()
+        untried = []
+        if not terminal:
+            untried = board.get_possible_moves().to_list()
+        return MCTSNode(move, pid, parent, untried, terminal)
+
+    def find_root(self, board, player):
+        """ Moves the root down the tree to the position on the board, or
+            starts a new tree if it isn't in there.
+        """
+        history = board.history
+        root = self.root
+        known = len(self.root_history)
+        if root is not None and known <= len(history):
+            for i in xrange(known):
+                if history[i] != self.root_history[i]:
+                    root = None
+                    break
+        else:
+            root = None
+        if root is not None:
+            for i in xrange(known, len(history)):
+                root = root.find_child(history[i])
+                if root is None:
+                    break
+        if root is None or root.terminal:
+            # the root's pid is the side that just moved.
+            root = self.make_node(board, board.get_last_move(),
+                                  player.get_next().pid, None)
+        root.parent = None
+        self.root = root
+        self.root_history = list(history)
+
+    def search(self, board, player, move_time=0):
+        """ Returns the chosen move's visit share; the move is left in
+            self.move as [x, y], or None if there is none.
+        """
+        self.start_time = time()
+        deadline = 0.0
+        if move_time > 0:
+            deadline = self.start_time + move_time / 1000.0
+        self.playouts = 0
+        self.find_root(board, player)
+        root = self.root
+        self.reused_visits = root.visits
+
+        iteration = 0
+        while iteration < self.iterations:
+            if (deadline > 0.0 and iteration % MCTS_TIME_CHECK_INTERVAL == 0
+                    and time() >= deadline):
+                break
+            self.iterate(board, root)
+            iteration += 1
+        self.elapsed = time() - self.start_time
+
+        self.move = None
+        best = root.get_most_visited()
+        if best is None:
+            return 0.0
+        self.move = [unpack_move_x(best.move), unpack_move_y(best.move)]
+        return float(best.visits) / root.visits
+
+    def iterate(self, board, root):
+        """ One selection, expansion, playout and backup. The board is
+            back as it was afterwards.
+        """
+        node = root
+        played = []
+        # selection
+        while not node.terminal and not node.untried and node.children:
+            node = node.select_child(self.exploration)
+            self.play(board, node.move, node.pid, played)
+        # expansion
+        if not node.terminal and node.untried:
+            untried = node.untried
+            index = self.random_index(len(untried))
+            move = untried[index]
+            untried[index] = untried[-1]
+            untried.pop()
+            pid = (node.pid + 1) % PLAYER_COUNT
+            self.play(board, move, pid, played)
+            child = self.make_node(board, move, pid, node)
+            node.children.append(child)
+            node = child
+        # playout
+        if node.terminal:
+            winner = node.pid
+        else:
+            winner = self.rollout(board, (node.pid + 1) % PLAYER_COUNT,
+                                  played)
+        self.playouts += 1
+        while played:
+            move = played.pop()
+            board.unmake_at(unpack_move_x(move), unpack_move_y(move))
+        # backup
+        while node is not None:
+            node.visits += 1
+            if winner == node.pid:
+                node.score += 1.0
+            elif winner < 0:
+                node.score += 0.5
+            node = node.parent
+
+    def play(self, board, move, pid, played):
+        board.put_at(unpack_move_x(move), unpack_move_y(move),
+                     Player.cache[pid])
+        played.append(move)
+
+    def rollout(self, board, pid, played):
+        """ Plays the game out from the board with pid to move. Returns
+            the winner's pid, or -1 for a draw.
+        """
+        # the cells completing five through the last move of each side,
+        # pid's own (mine) and the other side's (theirs).
+        mine = get_recent_five_cells(board, 2, pid)
+        theirs = get_recent_five_cells(board, 1, (pid + 1) % PLAYER_COUNT)
+        for _ in xrange(ROLLOUT_LIMIT):
+            move = self.get_rollout_move(board, mine, theirs)
+            if move == NO_MOVE:
+                return -1 # the board is full.
+            self.play(board, move, pid, played)
+            if board.last_move_wins():
+                return pid
+            cells = get_five_cells(board, unpack_move_x(move),
+                                   unpack_move_y(move), pid)
+            mine = theirs
+            theirs = cells
+            pid = (pid + 1) % PLAYER_COUNT
+        best = -1
+        best_hval = -1
+        for other in xrange(PLAYER_COUNT):
+            hval = board.get_hval(other)
+            if hval > best_hval:
+                best = other
+                best_hval = hval
+            elif hval == best_hval:
+                best = -1
+        return best
+
+    def get_rollout_move(self, board, mine, theirs):
+        """ Completes a five of the side to move if it can, blocks one of
+            the other side if it must, or picks a random candidate.
+        """
+        for move in mine:
+            if board.is_empty(unpack_move_x(move), unpack_move_y(move)):
+                return move
+        for move in theirs:
+            if board.is_empty(unpack_move_x(move), unpack_move_y(move)):
+                return move
+        # a few random cells first; the candidates are usually a good
+        # part of the board and listing them all costs more.
+        pmoves = board.get_possible_moves()
+        for _ in xrange(RANDOM_CELL_TRIES):
+            x = self.random_index(board.size)
+            y = self.random_index(board.size)
+            if pmoves.get_at(x, y):
+                return pack_move(x, y)
+        moves = pmoves.to_list()
+        if not moves:
+            return NO_MOVE
+        return moves[self.random_index(len(moves))]
@@ -29,67 +29,216 @@ BOARD_SIZE = 19
 def make_chess_space(size, fill=None):
     return [[fill] * size for _ in xrange(size)]
 
-def make_make_neighbours(width=2):
-    code = []
-    w = lambda s: code.append(s)
-    w('def make_neighbours(x, y):')
-    w('    return [')
-    range_x = range(width * 2 - 1) # 2 => (0, 1, 2)
-    range_y = range(width * 2 - 1) # 3 => (0, 1, 2, 3, 4)
-    for dx in range_x:
-        dx = dx - width + 1
-        for dy in range_y:
-            dy = dy - width + 1
-            if not dx == dy == 0:
-                w('    (x + %d, y + %d),' % (dx, dy))
-    w('    ]')
-    env = {}
-    exec '\n'.join(code) in env
-    #print '\n'.join(code)
-    return env['make_neighbours']
-
-# It already handles out-of-bound moves so there is no need
-# to check for illegal move in gamemodel.Board.add_possible_move
-def make_memorized_neighbours(width):
-    size = BOARD_SIZE
+def make_neighbour_table(size, width):
+    """ table[y][x] lists the on-board cells around (x, y) within
+        width - 1 steps, column by column from the left, each column
+        from the top. Plain loops, so boards of other sizes can build
+        one at runtime.
+    """
     table = [[None] * size for _ in xrange(size)]
-    make_neighbours = make_make_neighbours(width=width)
-    for x in xrange(size):
-        for y in xrange(size):
-            neighbours = [(nx, ny) for (nx, ny) in make_neighbours(x, y)
-                          if 0 <= nx < size and 0 <= ny < size]
+    for y in xrange(size):
+        for x in xrange(size):
+            neighbours = []
+            for dx in xrange(1 - width, width):
+                for dy in xrange(1 - width, width):
+                    nx = x + dx
+                    ny = y + dy
+                    if ((dx != 0 or dy != 0) and 0 <= nx < size and
+                            0 <= ny < size):
+                        neighbours.append((nx, ny))
             table[y][x] = neighbours
+    return table
 
-    def make_neighbours(x, y):
-        return table[y][x]
-    return make_neighbours
+# Neighbour tables shared by all boards, by (size << 8) | width.
+_neighbour_tables = {}
 
-make_neighbours = make_memorized_neighbours(2)
-make_larger_neighbours = make_memorized_neighbours(3)
+def get_neighbour_table(size, width):
+    key = (size << 8) | width
+    table = _neighbour_tables.get(key, None)
+    if table is None:
+        table = make_neighbour_table(size, width)
+        _neighbour_tables[key] = table
+    return table
 
+# Maps a single-bit word to the index of that bit, for bit-scanning with
+# the usual ``word & -word`` lowest-set-bit extraction.
+BIT_INDEX = dict([(1 << i, i) for i in xrange(64)])
+
+def lowest_bit(word):
+    return word & -word
+
+# Zobrist keys for incremental position hashing -- one random word per
+# (player, x, y), plus one per side to move. A fixed seed keeps the keys
+# identical between runs (and between processes).
+ZOBRIST_SEED = 0x5eed
+
+class ZobristRandom(object):
+    """ Park-Miller "minimal standard" generator. Only plain int
+        arithmetic, so keys for a new board size can also be made at
+        runtime after translation.
+    """
+    MODULUS = 2147483647
+
+    def __init__(self, seed):
+        self.state = seed % self.MODULUS
+        if self.state == 0:
+            self.state = 1
+
+    def next_31(self):
+        self.state = self.state * 48271 % self.MODULUS
+        return self.state
+
+    def next_key(self):
+        """ A 62-bit key from two draws. """
+        return (self.next_31() << 31) | self.next_31()
+
+def make_zobrist_keys(size, seed=ZOBRIST_SEED):
+    rand = ZobristRandom(seed)
+    return [[[rand.next_key() for _ in xrange(size)]
+             for _ in xrange(size)]
+            for _ in xrange(PLAYER_COUNT)]
+
+ZOBRIST_KEYS = make_zobrist_keys(BOARD_SIZE)
+ZOBRIST_TURN = [ZobristRandom(ZOBRIST_SEED + pid + 1).next_key()
+                for pid in xrange(PLAYER_COUNT)]
+
+# Zobrist keys by board size, made on first use.
+_zobrist_keys = {BOARD_SIZE: ZOBRIST_KEYS}
+
+def get_zobrist_keys(size):
+    keys = _zobrist_keys.get(size, None)
+    if keys is None:
+        keys = make_zobrist_keys(size)
+        _zobrist_keys[size] = keys
+    return keys
+
+# Moves stored in tables are packed into a single int.
+def pack_move(x, y):
+    return (y << 8) | x
+
+def unpack_move_x(move):
+    return move & 0xff
+
+def unpack_move_y(move):
+    return move >> 8
+
+NO_MOVE = -1
+
+# Bound types of a transposition table entry.
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+
+class TranspositionTable(object):
+    """ A fixed-size, direct-mapped table of search results.
+
+        Each slot stores the full key (to detect index collisions), the
+        remaining depth that was searched, the bound type, the value and
+        the best move found. Values are from the view of the player the
+        search was started for, so a table must not be shared by searches
+        for different players.
+
+        probe() copies a found entry into the probed_* fields, so other
+        implementations (see smp.py) can store entries however they like.
+    """
+    def __init__(self, size_bits=16):
+        size = 1 << size_bits
+        self.mask = size - 1
+        self.keys = [0] * size
+        self.depths = [-1] * size
+        self.flags = [TT_EXACT] * size
+        self.values = [0] * size
+        self.moves = [NO_MOVE] * size
+        self.probes = 0
+        self.hits = 0
+        self.probed_depth = -1
+        self.probed_flag = TT_EXACT
+        self.probed_value = 0
+        self.probed_move = NO_MOVE
+
+    def probe(self, key):
+        """ Returns True and fills the probed_* fields if key is stored. """
+        self.probes += 1
+        index = key & self.mask
+        if self.depths[index] >= 0 and self.keys[index] == key:
+            self.hits += 1
+            self.probed_depth = self.depths[index]
+            self.probed_flag = self.flags[index]
+            self.probed_value = self.values[index]
+            self.probed_move = self.moves[index]
+            return True
+        return False
+
+    def store(self, key, depth, flag, value, move):
+        index = key & self.mask
+        # Keep the deeper result when the same position is stored twice.
+        if self.keys[index] == key and self.depths[index] > depth:
+            return
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.flags[index] = flag
+        self.values[index] = value
+        self.moves[index] = move
+
+    def clear(self):
+        for i in xrange(self.mask + 1):
+            self.depths[i] = -1
+
+
+# Bits per BitSet word. 32 keeps every word a plain positive int on any
+# host, translated or not.
+WORD_BITS = 32
+WORD_SHIFT = 5
+WORD_MASK = WORD_BITS - 1
 
 class BitSet(object):
-    def __init__(self, size):
-        self.data = ['\0' * (size / 8 + 1)]
+    """ A set of the ints 0 .. size - 1 packed into 32-bit words. """
+    def __init__(self, size, data=None):
+        self.size = size
+        if data is None:
+            data = [0] * ((size + WORD_MASK) >> WORD_SHIFT)
+        self.data = data
 
     def put_at(self, nth):
-        hi = nth >> 3
-        lo = nth &  7
-        self.data[hi] |= (1 << lo)
+        self.data[nth >> WORD_SHIFT] |= 1 << (nth & WORD_MASK)
 
     def del_at(self, nth):
-        hi = nth >> 3
-        lo = nth &  7
-        self.data[hi] &= (~(1 << lo))
+        self.data[nth >> WORD_SHIFT] &= ~(1 << (nth & WORD_MASK))
 
     def get_at(self, nth):
-        hi = nth >> 3
-        lo = nth &  7
-        return self.data[hi] & (1 << lo)
+        return self.data[nth >> WORD_SHIFT] & (1 << (nth & WORD_MASK))
+
+    def clear(self):
+        for i in xrange(len(self.data)):
+            self.data[i] = 0
+
+    def make_copy(self):
+        return BitSet(self.size, self.data[:])
+
+    def to_list(self):
+        """ Lists the members in increasing order. """
+        res = []
+        for i in xrange(len(self.data)):
+            word = self.data[i]
+            base = i << WORD_SHIFT
+            while word:
+                low = lowest_bit(word)
+                res.append(base + BIT_INDEX[low])
+                word ^= low
+        return res
+
+    def count(self):
+        count = 0
+        for word in self.data:
+            while word:
+                word &= word - 1
+                count += 1
+        return count
 
 # For efficient move recording.
-# This is a small bitset with only 64-bit wide.
-# XXX: change to use the BitSet above instead? it's only 1/3 utilization...
+# One word per row, so rows can be at most 63 cells wide -- enough for
+# 51x51 boards. BitSet packs tighter, but a row per word keeps put_at and
+# get_at down to one shift.
 class SmallSet(object):
     def __init__(self, size, data=None):
         assert size < 64
@@ -113,11 +262,36 @@ class SmallSet(object):
     def make_copy(self):
         return SmallSet(self.size, self.data[:])
 
+    def to_list(self):
+        """ Lists the members as packed moves, in raster order. """
+        moves = []
+        for y in xrange(self.size):
+            word = self.data[y]
+            while word:
+                low = lowest_bit(word)
+                moves.append(pack_move(BIT_INDEX[low], y))
+                word ^= low
+        return moves
+
+    def count(self):
+        """ The number of members (popcount of all rows). """
+        count = 0
+        for word in self.data:
+            while word:
+                word &= word - 1
+                count += 1
+        return count
+
 class SmallSetIterator(object):
+    """ Walks the members in raster order, jumping from one set bit of a
+        row to the next with lowest-bit extraction.
+    """
     def __init__(self, base):
         self.base = base
-        self.x = -1
-        self.y = 0
+        self.x = 0
+        self.y = -1
+        # bits of row y not returned yet.
+        self.word = 0
         self.peeked = False
         self.closed = False
 
@@ -126,18 +300,18 @@ class SmallSetIterator(object):
             return False
         if self.peeked:
             return True
-        while True:
-            self.x += 1
-            if self.x >= self.base.size:
-                self.x = 0
-                self.y += 1
-                if self.y >= self.base.size:
-                    self.closed = True
-                    return False
-            value = self.base.get_at(self.x, self.y)
-            if value:
-                self.peeked = True
-                return True
+        word = self.word
+        while word == 0:
+            self.y += 1
+            if self.y >= self.base.size:
+                self.closed = True
+                return False
+            word = self.base.data[self.y]
+        low = lowest_bit(word)
+        self.word = word ^ low
+        self.x = BIT_INDEX[low]
+        self.peeked = True
+        return True
     has_next._always_inline_ = True
 
     def get_next(self):
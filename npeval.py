@@ -0,0 +1,118 @@
+""" npeval.py
+
+    A NumPy evaluation kernel for analysis and batch work. Not RPython --
+    only usable when running on CPython with numpy installed.
+
+    Boards are int8 arrays with 0 for empty and pid + 1 for a piece. The
+    kernel scores all runs of a player in one direction at once: run
+    starts are found by comparing the array with itself shifted by one
+    step, run lengths by walking all starts forward together, and the
+    two ends are then looked up to get the blockage. Every run of two or
+    more counts HVALTAB2[blockage][length], as PieceGroup.heuristic_eval
+    does, so the result agrees with the piece groups' values.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from model import PLAYER_COUNT
+from pieces import HVALTAB2, DIRECTION_STEPS
+
+MAX_RUN_LENGTH = len(HVALTAB2[0]) - 1
+# Value of the padding around the board -- blocks like an enemy piece.
+BORDER = -1
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError('npeval needs numpy')
+
+def board_to_array(board):
+    """ Copies a board's pieces into an int8 array. """
+    require_numpy()
+    arr = numpy.zeros((board.size, board.size), dtype=numpy.int8)
+    for y in xrange(board.size):
+        for x in xrange(board.size):
+            owner = board.get_owner_at(x, y)
+            if owner is not None:
+                arr[y, x] = owner.pid + 1
+    return arr
+
+def evaluate_batch(boards):
+    """ Scores a stack of boards shaped (count, size, size).
+
+        Returns an int64 array shaped (count, PLAYER_COUNT) holding the
+        sum of each player's run values.
+    """
+    require_numpy()
+    boards = numpy.asarray(boards, dtype=numpy.int8)
+    count = boards.shape[0]
+    padded = numpy.pad(boards, ((0, 0), (1, 1), (1, 1)), 'constant',
+                       constant_values=BORDER)
+    empty = padded == 0
+    limit_y = padded.shape[1] - 1
+    limit_x = padded.shape[2] - 1
+    table = numpy.array(HVALTAB2, dtype=numpy.int64)
+    hvals = numpy.zeros((count, PLAYER_COUNT), dtype=numpy.int64)
+
+    for pid in xrange(PLAYER_COUNT):
+        own = padded == pid + 1
+        for (dx, dy) in DIRECTION_STEPS:
+            # a run starts where the previous cell isn't own. The border
+            # is never own, so one-step shifts can't wrap around.
+            before = numpy.zeros_like(own)
+            before[:, 1:-1, 1:-1] = own[:, 1 - dy:limit_y - dy,
+                                        1 - dx:limit_x - dx]
+            (bs, ys, xs) = numpy.nonzero(own & ~before)
+
+            # walk all the starts forward together.
+            length = numpy.ones(len(bs), dtype=numpy.int64)
+            alive = numpy.ones(len(bs), dtype=bool)
+            step = 1
+            while alive.any() and step <= MAX_RUN_LENGTH:
+                cy = numpy.clip(ys + step * dy, 0, limit_y)
+                cx = numpy.clip(xs + step * dx, 0, limit_x)
+                alive &= own[bs, cy, cx]
+                length += alive
+                step += 1
+
+            blockage = ~empty[bs, ys - dy, xs - dx]
+            end_y = numpy.clip(ys + length * dy, 0, limit_y)
+            end_x = numpy.clip(xs + length * dx, 0, limit_x)
+            blockage = (blockage.astype(numpy.int64) +
+                        ~empty[bs, end_y, end_x])
+            length = numpy.minimum(length, MAX_RUN_LENGTH)
+            values = table[blockage, length]
+            values[length < 2] = 0
+            hvals[:, pid] += numpy.bincount(bs, weights=values,
+                                            minlength=count).astype(
+                                                    numpy.int64)
+    return hvals
+
+class NumpyEvaluator(object):
+    """ Board evaluator (see BoardBase.set_evaluator) that mirrors the
+        board in an int8 array and re-scores the whole array with the
+        kernel when a value is asked for after a change.
+    """
+    def __init__(self):
+        require_numpy()
+        self.array = None
+        self.hvals = None
+
+    def attach(self, board):
+        self.array = board_to_array(board)
+        self.hvals = None
+
+    def update_at(self, board, x, y):
+        owner = board.get_owner_at(x, y)
+        if owner is None:
+            self.array[y, x] = 0
+        else:
+            self.array[y, x] = owner.pid + 1
+        self.hvals = None
+
+    def get_hval(self, pid):
+        if self.hvals is None:
+            self.hvals = evaluate_batch(self.array[numpy.newaxis])[0]
+        return int(self.hvals[pid])
@@ -0,0 +1,118 @@
+""" ordering.py
+
+    Move ordering for the alpha-beta search.
+
+    Alpha-beta prunes the most when the best move is searched first, so
+    candidates are tried in this order:
+        1. the hash move -- best move stored in the transposition table
+           (or the move fed forward by iterative deepening at the root),
+        2. the killer moves of the ply -- quiet moves that caused a
+           cutoff in a sibling node,
+        3. the rest, by history score (how often the move has caused
+           cutoffs, weighted by depth) and then by a cheap static threat
+           score computed from the stones around the move.
+"""
+
+from model import PLAYER_COUNT, NO_MOVE, unpack_move_x, unpack_move_y
+
+MAX_PLY = 128
+KILLER_SLOTS = 2
+
+# Sort keys of the fixed-position moves, above any history score.
+HASH_MOVE_SCORE = 1 << 50
+KILLER_SCORE = 1 << 48
+
+# The static score breaks ties between equal history scores.
+STATIC_SCORE_LIMIT = 1 << 10
+
+# Directions of the four lines through a cell.
+LINE_DIRECTIONS = [(1, 0), (0, 1), (1, 1), (1, -1)]
+
+def count_run(board, x, y, dx, dy, owner):
+    """ Counts owner's pieces next to (x, y) in direction (dx, dy). """
+    count = 0
+    x += dx
+    y += dy
+    while True:
+        if board.get_owner_at(x, y) is not owner:
+            return count
+        count += 1
+        x += dx
+        y += dy
+
+def static_threat_score(board, x, y, mover):
+    """ Scores a move by the runs it would extend or block. Extending an
+        own run counts twice as much as blocking an enemy one.
+    """
+    enemy = mover.get_next()
+    score = 0
+    for (dx, dy) in LINE_DIRECTIONS:
+        own = (count_run(board, x, y, dx, dy, mover) +
+               count_run(board, x, y, -dx, -dy, mover))
+        blocked = (count_run(board, x, y, dx, dy, enemy) +
+                   count_run(board, x, y, -dx, -dy, enemy))
+        score += 2 * own * own + blocked * blocked
+    if score >= STATIC_SCORE_LIMIT:
+        score = STATIC_SCORE_LIMIT - 1
+    return score
+
+class MoveOrderer(object):
+    def __init__(self, use_static=True):
+        self.use_static = use_static
+        self.killers = [NO_MOVE] * (MAX_PLY * KILLER_SLOTS)
+        # indexed by packed move, one table per player.
+        self.history = [[0] * (1 << 16) for _ in xrange(PLAYER_COUNT)]
+
+    def age(self):
+        """ Called between two searches: old killers are forgotten, and
+            history scores are halved so recent cutoffs weigh more.
+        """
+        for i in xrange(len(self.killers)):
+            self.killers[i] = NO_MOVE
+        for table in self.history:
+            for i in xrange(len(table)):
+                if table[i]:
+                    table[i] >>= 1
+
+    def record_cutoff(self, move, depth, ply, mover):
+        if ply < MAX_PLY:
+            base = ply * KILLER_SLOTS
+            if self.killers[base] != move:
+                self.killers[base + 1] = self.killers[base]
+                self.killers[base] = move
+        self.history[mover.pid][move] += depth * depth
+
+    def order(self, board, pmoves, ply, mover, hash_move):
+        """ Returns the candidate moves in pmoves, best first. """
+        killer1 = NO_MOVE
+        killer2 = NO_MOVE
+        if ply < MAX_PLY:
+            killer1 = self.killers[ply * KILLER_SLOTS]
+            killer2 = self.killers[ply * KILLER_SLOTS + 1]
+        history = self.history[mover.pid]
+
+        moves = []
+        scores = []
+        for move in pmoves.to_list():
+            if move == hash_move:
+                score = HASH_MOVE_SCORE
+            elif move == killer1:
+                score = KILLER_SCORE + 1
+            elif move == killer2:
+                score = KILLER_SCORE
+            else:
+                score = history[move] * STATIC_SCORE_LIMIT
+                if self.use_static:
+                    score += static_threat_score(board, unpack_move_x(move),
+                                                 unpack_move_y(move), mover)
+            # insertion sort, descending. Ties keep the raster order.
+            i = len(moves)
+            moves.append(move)
+            scores.append(score)
+            while i > 0 and scores[i - 1] < score:
+                moves[i] = moves[i - 1]
+                scores[i] = scores[i - 1]
+                i -= 1
+            moves[i] = move
+            scores[i] = score
+        return moves
@@ -0,0 +1,134 @@
+""" parallel.py
+
+    Root-parallel alpha-beta over a multiprocessing pool. Not RPython.
+
+    The root moves are ordered as the sequential search would try them
+    and handed out one at a time. Every worker process keeps its own copy
+    of the board (rebuilt from the stones whenever the position changes),
+    and its own transposition table and move orderer. The root alpha
+    lives in shared memory: a worker reads it before searching a move and
+    raises it when it finds a better one, so later moves in every worker
+    are searched with the tightest bound known so far.
+"""
+
+import ctypes
+import multiprocessing
+
+from board import Board
+from model import (Player, TranspositionTable, NO_MOVE, unpack_move_x,
+                   unpack_move_y)
+from ai import Future, SearchState, INFINITY
+from ordering import MoveOrderer
+
+# Per-process state of the pool workers.
+_shared_alpha = None
+_worker_board = None
+_worker_states = {}
+# the root search each worker state last searched for, by pid.
+_worker_search_ids = {}
+
+def _init_worker(shared_alpha):
+    global _shared_alpha
+    _shared_alpha = shared_alpha
+
+def _get_worker_board(size, stones, board_hash):
+    global _worker_board
+    if (_worker_board is None or _worker_board.size != size or
+            _worker_board.get_hash() != board_hash):
+        _worker_board = Board(size)
+        for (x, y, pid) in stones:
+            _worker_board.put_at(x, y, Player.cache[pid])
+    return _worker_board
+
+def _get_worker_state(pid):
+    state = _worker_states.get(pid)
+    if state is None:
+        state = SearchState(TranspositionTable(), MoveOrderer())
+        _worker_states[pid] = state
+    return state
+
+def _search_root_move(task):
+    """ Searches one root move. Returns (value, move, exact, nodes);
+        exact is False when the move failed low, so value is just an
+        upper bound.
+    """
+    (size, stones, board_hash, pid, depth, move, search_id) = task
+    board = _get_worker_board(size, stones, board_hash)
+    player = Player.cache[pid]
+    state = _get_worker_state(pid)
+    # the history is aged once per root search, not once per root move.
+    if _worker_search_ids.get(pid) != search_id:
+        _worker_search_ids[pid] = search_id
+        state.new_search()
+    else:
+        state.reset_counters()
+
+    alpha = _shared_alpha.value
+    x = unpack_move_x(move)
+    y = unpack_move_y(move)
+    board.put_at(x, y, player)
+    future = Future(board, player, state)
+    value = future.alphabeta(depth - 1, alpha, INFINITY, player.get_next(), 1)
+    board.unmake_at(x, y)
+
+    exact = value > alpha
+    if exact:
+        lock = _shared_alpha.get_lock()
+        lock.acquire()
+        try:
+            if value > _shared_alpha.value:
+                _shared_alpha.value = value
+        finally:
+            lock.release()
+    return (value, move, exact, state.nodes)
+
+class RootParallelSearch(object):
+    """ Searches the root moves of a position across processes. The pool
+        is created once and reused for every search.
+    """
+    def __init__(self, processes=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.shared_alpha = multiprocessing.Value(ctypes.c_longlong,
+                                                  -INFINITY)
+        self.pool = multiprocessing.Pool(processes, _init_worker,
+                                         (self.shared_alpha,))
+        self.nodes = 0
+        self.move = None
+        self.searches = 0
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def search(self, board, player, depth):
+        """ Returns the root value; the best move is left in self.move. """
+        self.shared_alpha.value = -INFINITY
+        self.move = None
+        self.nodes = 0
+        self.searches += 1
+        root_state = SearchState(orderer=MoveOrderer())
+        root = Future(board, player, root_state)
+        moves = root.get_ordered_moves(board.get_possible_moves(), 0,
+                                       player, NO_MOVE)
+        stones = board.get_stones()
+        board_hash = board.get_hash()
+        tasks = [(board.size, stones, board_hash, player.pid, depth, move,
+                  self.searches) for move in moves]
+
+        best_value = -INFINITY
+        best_move = NO_MOVE
+        best_exact = False
+        for (value, move, exact, nodes) in self.pool.imap(
+                _search_root_move, tasks, 1):
+            self.nodes += nodes
+            # an exact value beats a fail-low bound of the same size.
+            if (value > best_value or
+                    (value == best_value and exact and not best_exact)):
+                best_value = value
+                best_move = move
+                best_exact = exact
+        if best_move != NO_MOVE:
+            self.move = [unpack_move_x(best_move), unpack_move_y(best_move)]
+        return best_value
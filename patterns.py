@@ -0,0 +1,193 @@
+""" patterns.py
+
+    A line-pattern evaluator driven by a precomputed lookup table.
+
+    Each cell of a line is looked at through a window of the 9 cells
+    centred on it, encoded in base 3 -- 0 for empty, 1 for the scored
+    player's piece and 2 for anything that blocks (an enemy piece or the
+    edge of the board). PATTERN_TABLE[code] holds the value the window
+    contributes, so scoring a line for a player is a slide of the window
+    plus one table lookup per cell.
+
+    A window scores in two cases:
+        - its centre starts a run of the player's pieces: the run counts
+          HVALTAB2[blockage][length], as in PieceGroup.heuristic_eval,
+        - its centre is a gap with pieces on both sides (XX_X, X_XXX,
+          ...): the pieces around the gap count as a split shape. Three
+          of them are worth a three, four or more a closed four, since
+          filling the gap is the only way to complete them.
+
+    A window only sees the first five cells of a run, so score_line
+    counts a run of five or more on the line itself: an overline scores
+    HVALTAB2 of its own length, as its group does.
+
+    Only the four lines through a changed cell are re-scored.
+"""
+
+from model import PLAYER_COUNT
+from pieces import HVALTAB2, DIRECTION_STEPS
+
+WINDOW = 9
+CENTER = WINDOW // 2
+TABLE_SIZE = 3 ** WINDOW
+TOP_DIGIT = 3 ** (WINDOW - 1)
+
+EMPTY = 0
+OWN = 1
+BLOCKED = 2
+
+def decode_window(code):
+    cells = []
+    for _ in xrange(WINDOW):
+        cells.append(code % 3)
+        code //= 3
+    return cells
+
+def count_own(cells, start, step):
+    count = 0
+    i = start
+    while 0 <= i < WINDOW and cells[i] == OWN:
+        count += 1
+        i += step
+    return count
+
+def is_blocked(cells, i):
+    # Cells past the window are assumed open.
+    return 0 <= i < WINDOW and cells[i] == BLOCKED
+
+def split_value(blockage, nb_pieces):
+    if nb_pieces >= 4:
+        return HVALTAB2[1][4]
+    elif nb_pieces == 3:
+        return HVALTAB2[blockage][3]
+    return HVALTAB2[blockage][2] // 2
+
+def window_value(cells):
+    if cells[CENTER] == OWN and cells[CENTER - 1] != OWN:
+        length = count_own(cells, CENTER, 1)
+        if length < 2:
+            return 0
+        blockage = 0
+        if cells[CENTER - 1] == BLOCKED:
+            blockage += 1
+        if is_blocked(cells, CENTER + length):
+            blockage += 1
+        return HVALTAB2[blockage][length]
+    elif (cells[CENTER] == EMPTY and cells[CENTER - 1] == OWN and
+            cells[CENTER + 1] == OWN):
+        left = count_own(cells, CENTER - 1, -1)
+        right = count_own(cells, CENTER + 1, 1)
+        blockage = 0
+        if is_blocked(cells, CENTER - left - 1):
+            blockage += 1
+        if is_blocked(cells, CENTER + right + 1):
+            blockage += 1
+        return split_value(blockage, left + right)
+    return 0
+
+# A run the window can't see the end of scores at least this.
+FIVE_VALUE = HVALTAB2[0][WINDOW - CENTER]
+MAX_RUN = len(HVALTAB2[0]) - 1
+
+def make_pattern_table():
+    return [window_value(decode_window(code)) for code in xrange(TABLE_SIZE)]
+
+# Generated once at import: 3 ** 9 entries.
+PATTERN_TABLE = make_pattern_table()
+
+# The code of the CENTER cells before the start of a line.
+OFF_BOARD_PREFIX = sum([BLOCKED * 3 ** i for i in xrange(CENTER)])
+
+def cell_value(line, i, length, pid):
+    if i >= length:
+        return BLOCKED
+    owner = line[i]
+    if owner < 0:
+        return EMPTY
+    elif owner == pid:
+        return OWN
+    return BLOCKED
+
+class PatternEvaluator(object):
+    """ Keeps the per-player pattern score of a board. Attach it with
+        board.set_evaluator(); the board then calls update_at() after
+        every put_at/del_at.
+    """
+    def __init__(self):
+        self.size = 0
+        # cached line scores, indexed by the line's first cell.
+        self.line_hvals = []
+        self.hvals = [0] * PLAYER_COUNT
+
+    def attach(self, board):
+        size = board.size
+        self.size = size
+        self.line_hvals = [0] * (len(DIRECTION_STEPS) * size * size *
+                                 PLAYER_COUNT)
+        self.hvals = [0] * PLAYER_COUNT
+        for y in xrange(board.size):
+            for x in xrange(board.size):
+                if not board.is_empty(x, y):
+                    self.update_at(board, x, y)
+
+    def get_hval(self, pid):
+        return self.hvals[pid]
+
+    def update_at(self, board, x, y):
+        for direction in xrange(len(DIRECTION_STEPS)):
+            (dx, dy) = DIRECTION_STEPS[direction]
+            # walk back to the first cell of the line.
+            sx = x
+            sy = y
+            while board.pos_is_valid(sx - dx, sy - dy):
+                sx -= dx
+                sy -= dy
+            line = self.read_line(board, sx, sy, dx, dy)
+            line_key = (direction * self.size + sy) * self.size + sx
+            for pid in xrange(PLAYER_COUNT):
+                hval = self.score_line(line, pid)
+                key = line_key * PLAYER_COUNT + pid
+                self.hvals[pid] += hval - self.line_hvals[key]
+                self.line_hvals[key] = hval
+
+    def read_line(self, board, x, y, dx, dy):
+        """ Lists the owner pids along a line, -1 for empty cells. """
+        line = []
+        while board.pos_is_valid(x, y):
+            owner = board.get_owner_at(x, y)
+            if owner is None:
+                line.append(-1)
+            else:
+                line.append(owner.pid)
+            x += dx
+            y += dy
+        return line
+
+    def score_line(self, line, pid):
+        """ Slides the window along the line, scoring it for pid. """
+        if pid not in line:
+            return 0
+        length = len(line)
+        # the first window: CENTER blocked cells off the board, then the
+        # first cells of the line.
+        code = OFF_BOARD_PREFIX
+        digit = 3 ** CENTER
+        for i in xrange(WINDOW - CENTER):
+            code += cell_value(line, i, length, pid) * digit
+            digit *= 3
+        hval = 0
+        for i in xrange(length):
+            value = PATTERN_TABLE[code]
+            if value >= FIVE_VALUE:
+                value = HVALTAB2[0][self.run_length(line, i, length, pid)]
+            hval += value
+            code = (code // 3 + cell_value(line, i + WINDOW - CENTER,
+                                           length, pid) * TOP_DIGIT)
+        return hval
+
+    def run_length(self, line, i, length, pid):
+        """ The length of pid's run starting at i, past the window. """
+        end = i
+        while end < length and line[end] == pid:
+            end += 1
+        return min(end - i, MAX_RUN)
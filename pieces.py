@@ -32,7 +32,24 @@ HVALTAB2 = [
     [0, 0, 0,  0,    0,  99999, 999999, 9999999, 99999999], # blockade 2
 ]
 
+# Line directions, one per group class.
+DIR_HORIZONTAL = 0 # -
+DIR_VERTICAL = 1 # |
+DIR_DIAGONAL_DOWN = 2 # \
+DIR_DIAGONAL_UP = 3 # /
+
+# (dx, dy) steps along each direction, indexed by direction.
+DIRECTION_STEPS = [(1, 0), (0, 1), (1, 1), (1, -1)]
+
+# Group changes journaled by put_at, see undo_group_change.
+GROUP_CREATED = 0 # value unused.
+GROUP_EXTENDED = 1 # value: the group's hval before.
+GROUP_DISBANDED = 2 # value unused.
+GROUP_UNLINKED = 3 # value: (index in piece.groups << 8) | piece index.
+
 class Piece(object):
+    __slots__ = ('x', 'y', 'groups', 'owner')
+
     def __init__(self, x, y, owner):
         self.x = x
         self.y = y
@@ -44,55 +61,81 @@ class Piece(object):
                                           self.groups)
 
 class PieceGroup(object):
+    __slots__ = ('pieces', 'hval', 'length', 'min_x', 'min_y', 'max_x',
+                 'max_y', 'manager_index')
+    direction = -1
 
     def __init__(self):
         self.pieces = []
+        # heuristic value at the time it was last put into or refreshed
+        # by the group manager.
+        self.hval = 0
+        # bounding box of the pieces, kept up to date by add/pop_piece.
+        self.length = 0
+        self.min_x = 0
+        self.min_y = 0
+        self.max_x = 0
+        self.max_y = 0
+        # position in the group manager's list for its length.
+        self.manager_index = -1
 
     def get_length(self):
-        return len(self.pieces)
+        return self.length
 
     def get_hval(self):
-        return HVALTAB[self.get_length()]
+        return HVALTAB[self.length]
 
     def get_min_x(self):
-        # pypy work around..
-        min_x = self.pieces[0].x
-        for pc in self.pieces:
-            if pc.x < min_x:
-                min_x = pc.x
-        return min_x
+        return self.min_x
 
     def get_min_y(self):
-        # pypy work around..
-        min_y = self.pieces[0].y
-        for pc in self.pieces:
-            if pc.y < min_y:
-                min_y = pc.y
-        return min_y
+        return self.min_y
 
     def get_max_x(self):
-        # pypy work around..
-        max_x = self.pieces[0].x
-        for pc in self.pieces:
-            if pc.x > max_x:
-                max_x = pc.x
-        return max_x
+        return self.max_x
 
     def get_max_y(self):
-        # pypy work around..
-        max_y = self.pieces[0].y
-        for pc in self.pieces:
-            if pc.y > max_y:
-                max_y = pc.y
-        return max_y
+        return self.max_y
 
     def get_owner(self):
         return self.pieces[0].owner
 
     def add(self, piece):
+        if self.length == 0:
+            self.min_x = self.max_x = piece.x
+            self.min_y = self.max_y = piece.y
+        else:
+            if piece.x < self.min_x:
+                self.min_x = piece.x
+            elif piece.x > self.max_x:
+                self.max_x = piece.x
+            if piece.y < self.min_y:
+                self.min_y = piece.y
+            elif piece.y > self.max_y:
+                self.max_y = piece.y
         self.pieces.append(piece)
+        self.length += 1
         piece.groups.append(self)
 
+    def pop_piece(self):
+        """ Takes back the last add(). The piece was at one end of the
+            line, so the bounds just lose that end.
+        """
+        piece = self.pieces.pop()
+        piece.groups.pop()
+        self.length -= 1
+        if self.length > 0:
+            (dx, dy) = DIRECTION_STEPS[self.direction]
+            if piece.x == self.min_x and dx != 0:
+                self.min_x += 1
+            elif piece.x == self.max_x and dx != 0:
+                self.max_x -= 1
+            if piece.y == self.min_y and dy != 0:
+                self.min_y += 1
+            elif piece.y == self.max_y and dy != 0:
+                self.max_y -= 1
+        return piece
+
     def remove(self, board, piece):
         raise NotImplementedError
 
@@ -100,9 +143,13 @@ class PieceGroup(object):
         raise NotImplementedError
 
     def disband(self, board):
+        board.log_group_change(GROUP_DISBANDED, self, 0)
         board.del_piece_group(self)
-        for piece in self.pieces:
-            piece.groups.remove(self)
+        for i in xrange(len(self.pieces)):
+            piece = self.pieces[i]
+            index = piece.groups.index(self)
+            board.log_group_change(GROUP_UNLINKED, self, (index << 8) | i)
+            del piece.groups[index]
 
     def is_superset_of(self, group):
         raise NotImplementedError
@@ -113,6 +160,7 @@ class PieceGroup(object):
 
 class GroupWithChangeInX(PieceGroup):
     """ Those three groups (\\) (-) (/) can share the same remove method. """
+    __slots__ = ()
     def __init__(self):
         #super(GroupWithChangeInX, self).__init__()
         PieceGroup.__init__(self) # workaround.
@@ -141,6 +189,9 @@ class GroupWithChangeInX(PieceGroup):
 
 class DiagonalUp(GroupWithChangeInX):
     ' / '
+    __slots__ = ()
+    direction = DIR_DIAGONAL_UP
+
     def __init__(self):
         #super(DiagonalUp, self).__init__()
         GroupWithChangeInX.__init__(self) # workaround.
@@ -154,11 +205,13 @@ class DiagonalUp(GroupWithChangeInX):
         min_y = self.get_min_y()
 
         if piece.x == min_x - 1 and piece.y == min_y + self_len:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # piece -v ./
             self.add(piece)
             look_ahead = board.get_at(piece.x - 1, piece.y + 1)
         elif piece.x == min_x + self_len and piece.y == min_y - 1:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # / ^- piece
             self.add(piece)
@@ -199,7 +252,7 @@ class DiagonalUp(GroupWithChangeInX):
         if not board.pos_is_valid(*left_pt) or board.get_at(*left_pt):
             blockage += 1
 
-        rite_pt = (min_x + self_len, max_y + self_len)
+        rite_pt = (min_x + self_len, max_y - self_len)
         if not board.pos_is_valid(*rite_pt) or board.get_at(*rite_pt):
             blockage += 1
         return HVALTAB2[blockage][self_len]
@@ -207,6 +260,9 @@ class DiagonalUp(GroupWithChangeInX):
 
 class DiagonalDown(GroupWithChangeInX):
     ' \ '
+    __slots__ = ()
+    direction = DIR_DIAGONAL_DOWN
+
     def __init__(self):
         #super(DiagonalDown, self).__init__()
         GroupWithChangeInX.__init__(self) # workaround.
@@ -221,11 +277,13 @@ class DiagonalDown(GroupWithChangeInX):
         min_y = self.get_min_y()
 
         if piece.x == min_x - 1 and piece.y == min_y - 1:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # piece -^ \
             self.add(piece)
             look_ahead = board.get_at(piece.x - 1, piece.y - 1)
         elif piece.x == min_x + self_len and piece.y == min_y + self_len:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # \ v- piece
             self.add(piece)
@@ -274,6 +332,9 @@ class DiagonalDown(GroupWithChangeInX):
 
 class Horizontal(GroupWithChangeInX):
     ' - '
+    __slots__ = ()
+    direction = DIR_HORIZONTAL
+
     def __init__(self):
         GroupWithChangeInX.__init__(self) # workaround for pypy
         #super(Horizontal, self).__init__()
@@ -287,11 +348,13 @@ class Horizontal(GroupWithChangeInX):
         min_y = self.get_min_y()
 
         if piece.x == min_x - 1 and piece.y == min_y:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # piece -> -
             self.add(piece)
             look_ahead = board.get_at(piece.x - 1, piece.y)
         elif piece.x == min_x + self_len and piece.y == min_y:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # \ v- piece
             self.add(piece)
@@ -340,6 +403,7 @@ class Horizontal(GroupWithChangeInX):
 
 class GroupWithChangeInY(PieceGroup):
     """ This group (|) has a different remove method. """
+    __slots__ = ()
     def __init__(self):
         #super(GroupWithChangeInY, self).__init__()
         PieceGroup.__init__(self) # workaround.
@@ -367,6 +431,9 @@ class GroupWithChangeInY(PieceGroup):
 
 class Vertical(GroupWithChangeInY):
     ' - '
+    __slots__ = ()
+    direction = DIR_VERTICAL
+
     def __init__(self):
         #super(Vertical, self).__init__()
         GroupWithChangeInY.__init__(self) # workaround.
@@ -381,11 +448,13 @@ class Vertical(GroupWithChangeInY):
         min_y = self.get_min_y()
 
         if piece.x == min_x and piece.y == min_y - 1:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # piece -> -
             self.add(piece)
             look_ahead = board.get_at(piece.x, piece.y - 1)
         elif piece.x == min_x and piece.y == min_y + self_len:
+            board.log_group_change(GROUP_EXTENDED, self, self.hval)
             board.del_piece_group(self)
             # \ v- piece
             self.add(piece)
@@ -454,6 +523,7 @@ def merge_dual(board, new, old):
     new_group.add(new)
     new_group.add(old)
     board.add_piece_group(new_group)
+    board.log_group_change(GROUP_CREATED, new_group, 0)
 
     # try to merge ahead. XXX: pypy hack to use list
     piece1, piece2 = board.get_at(*look_ahead_1), board.get_at(*look_ahead_2)
@@ -465,15 +535,84 @@ def merge_dual(board, new, old):
                     group.disband(board)
 
 
+def undo_group_change(board, change, group, value):
+    """ Reverts one journaled change. Replayed newest first, so every
+        list is back in the state right after the change was made.
+    """
+    if change == GROUP_CREATED:
+        board.del_piece_group(group)
+        for piece in group.pieces:
+            piece.groups.pop()
+    elif change == GROUP_EXTENDED:
+        board.del_piece_group(group)
+        group.pop_piece()
+        group.hval = value
+        board.piece_groups[group.get_owner().pid].put(group)
+    elif change == GROUP_DISBANDED:
+        board.piece_groups[group.get_owner().pid].put(group)
+    elif change == GROUP_UNLINKED:
+        piece = group.pieces[value & 0xff]
+        piece.groups.insert(value >> 8, group)
+
+
+def refresh_blocked_groups(board, x, y, owner):
+    """ Called after (x, y) is taken or freed by owner: the other players'
+        groups ending next to (x, y) changed their blockage, so their
+        cached heuristic values need an update. Owner's own groups there
+        were rebuilt by the merge/remove and are already up to date.
+    """
+    for direction in xrange(len(DIRECTION_STEPS)):
+        (dx, dy) = DIRECTION_STEPS[direction]
+        for neighbour in [board.get_at(x + dx, y + dy),
+                          board.get_at(x - dx, y - dy)]:
+            if neighbour and neighbour.owner is not owner:
+                for group in neighbour.groups:
+                    if group.direction == direction:
+                        board.refresh_piece_group(group)
+
+
 class PieceGroupManager(object):
+    """ Owns the piece groups of a player, bucketed by length, and keeps
+        the sum of their heuristic values up to date.
+
+        Every group knows its index in its bucket, so remove() moves the
+        bucket's last group into the hole instead of searching the list.
+        A group must be removed before its length changes.
+    """
     def __init__(self, piece_lengths):
         self._groups = [[] for _ in xrange(piece_lengths + 1)]
+        self.hval = 0
+
+    def put(self, group):
+        bucket = self._groups[group.get_length()]
+        group.manager_index = len(bucket)
+        bucket.append(group)
+        self.hval += group.hval
+
+    def remove(self, group):
+        bucket = self._groups[group.get_length()]
+        index = group.manager_index
+        last = bucket.pop()
+        if last is not group:
+            bucket[index] = last
+            last.manager_index = index
+        group.manager_index = -1
+        self.hval -= group.hval
+
+    def refresh(self, group, hval):
+        self.hval += hval - group.hval
+        group.hval = hval
 
-    def put(self, piece):
-        self._groups[piece.get_length()].append(piece)
-
-    def remove(self, piece):
-        self._groups[piece.get_length()].remove(piece)
+    def get_hval(self):
+        return self.hval
+
+    def compute_hval(self, board):
+        """ Sums the groups' heuristic values from scratch. """
+        hval = 0
+        for groups in self._groups:
+            for group in groups:
+                hval += group.heuristic_eval(board)
+        return hval
 
     def count_of(self, len_spec):
         return len(self._groups[len_spec])
@@ -0,0 +1,318 @@
+""" pns.py
+
+    Depth-first proof-number search (df-pn) for solving positions: does
+    the attacker, to move, have a forced win?
+
+    Every node has a proof number (how many more leaves at least have to
+    be shown won to prove it) and a disproof number (the same for lost).
+    At the attacker's nodes the proof number is the least of the
+    children's and the disproof number their sum; at the defender's
+    nodes the other way around. df-pn always goes down to the most
+    proving child, with thresholds that send it back up as soon as
+    another child becomes more promising, and keeps the numbers of the
+    positions it has seen in a fixed-size table instead of in a tree.
+
+    A game is won by a five: a side that can complete one on its move
+    wins, and a side facing two cells where the other side completes
+    one loses. Both are read from the lines through the last few moves.
+    Only Board is supported, since the end of the game is read from its
+    piece groups (PieceGroupManager.count_of).
+
+    With threats_only (the default) the attacker only plays fours and
+    threes, as in threats.py, which keeps the tree small enough to be
+    solved; a disproof then only says there is no forced win by threats.
+    The defender always gets every candidate move.
+"""
+
+from model import ZOBRIST_TURN, NO_MOVE, unpack_move_x, unpack_move_y
+from threats import get_recent_five_cells, is_four, get_three_directions
+
+PN_INFINITY = 1 << 40
+PNS_NODE_LIMIT = 100000
+PNS_TABLE_BITS = 16
+PNS_BUCKET_SLOTS = 4
+# How many of the last moves are looked at for fives to complete.
+PNS_HISTORY = 4
+
+# ProofNumberSearch.status values.
+PNS_UNSOLVED = 0
+PNS_WIN = 1
+PNS_NO_WIN = 2
+PNS_STATUS_NAMES = ['unsolved', 'win', 'no win']
+
+def is_won(board, pid):
+    """ Whether pid has five or more in a row, by its groups' lengths. """
+    manager = board.get_piece_groups()[pid]
+    for length in xrange(5, len(manager.get_groups())):
+        if manager.count_of(length):
+            return True
+    return False
+
+def add_numbers(a, b):
+    if a + b >= PN_INFINITY:
+        return PN_INFINITY
+    return a + b
+
+class ProofTable(object):
+    """ A fixed-size table of proof and disproof numbers, in buckets of
+        PNS_BUCKET_SLOTS slots. A new position takes an empty slot of its
+        bucket, else an unsolved one; solved positions are only given up
+        when the whole bucket is solved.
+    """
+    def __init__(self, size_bits=PNS_TABLE_BITS):
+        size = 1 << size_bits
+        self.mask = size - PNS_BUCKET_SLOTS
+        self.keys = [0] * size
+        self.pns = [0] * size # 0/0 marks an empty slot.
+        self.dns = [0] * size
+        self.probed_pn = 1
+        self.probed_dn = 1
+
+    def find(self, key):
+        """ The slot holding key, or -1. """
+        index = key & self.mask
+        for slot in xrange(index, index + PNS_BUCKET_SLOTS):
+            if self.keys[slot] == key and (self.pns[slot] or self.dns[slot]):
+                return slot
+        return -1
+
+    def probe(self, key):
+        """ Returns True and fills probed_pn/dn if key is stored. """
+        slot = self.find(key)
+        if slot < 0:
+            return False
+        self.probed_pn = self.pns[slot]
+        self.probed_dn = self.dns[slot]
+        return True
+
+    def get_free_slot(self, key):
+        index = key & self.mask
+        unsolved = -1
+        for slot in xrange(index, index + PNS_BUCKET_SLOTS):
+            pn = self.pns[slot]
+            dn = self.dns[slot]
+            if pn == 0 and dn == 0:
+                return slot
+            if pn != 0 and dn != 0:
+                unsolved = slot
+        if unsolved < 0:
+            return index + PNS_BUCKET_SLOTS - 1
+        return unsolved
+
+    def store(self, key, pn, dn):
+        slot = self.find(key)
+        if slot < 0:
+            slot = self.get_free_slot(key)
+        self.keys[slot] = key
+        self.pns[slot] = pn
+        self.dns[slot] = dn
+
+    def clear(self):
+        for i in xrange(len(self.keys)):
+            self.pns[i] = 0
+            self.dns[i] = 0
+
+class ProofNumberSearch(object):
+    """ Solves positions within node_limit nodes. solve() returns the
+        status; a proven win leaves its line in self.line (packed moves,
+        attacker and defender taking turns, as far as the table still
+        holds it).
+    """
+    def __init__(self, node_limit=PNS_NODE_LIMIT, size_bits=PNS_TABLE_BITS,
+                 threats_only=True):
+        self.node_limit = node_limit
+        self.threats_only = threats_only
+        self.table = ProofTable(size_bits)
+        self.attacker = None
+        self.nodes = 0
+        self.status = PNS_UNSOLVED
+        self.line = []
+
+    def solve(self, board, attacker):
+        self.attacker = attacker
+        self.nodes = 0
+        self.line = []
+        self.table.clear()
+        if is_won(board, attacker.get_next().pid):
+            self.status = PNS_NO_WIN
+            return self.status
+        (pn, dn) = self.mid(board, attacker, PN_INFINITY, PN_INFINITY)
+        if pn == 0:
+            self.status = PNS_WIN
+            self.line = self.get_proof_line(board)
+        elif dn == 0:
+            self.status = PNS_NO_WIN
+        else:
+            self.status = PNS_UNSOLVED
+        return self.status
+
+    def get_key(self, board, mover):
+        return board.get_hash() ^ ZOBRIST_TURN[mover.pid]
+
+    def get_child_key(self, board, move, mover):
+        """ The key after mover plays move, without playing it. """
+        x = unpack_move_x(move)
+        y = unpack_move_y(move)
+        return (board.get_hash() ^ board.zobrist_keys[mover.pid][y][x] ^
+                ZOBRIST_TURN[mover.get_next().pid])
+
+    def get_moves(self, board, mover):
+        """ The moves to search, or None if the node is decided: mover
+            wins on the spot, or can't stop a five. An empty list means
+            mover has no move (to search).
+        """
+        if get_recent_five_cells(board, PNS_HISTORY, mover.pid):
+            return None
+        blocks = get_recent_five_cells(board, PNS_HISTORY,
+                                       mover.get_next().pid)
+        if len(blocks) > 1:
+            return None
+        if blocks:
+            return blocks
+        moves = board.get_possible_moves().to_list()
+        if mover is not self.attacker or not self.threats_only:
+            return moves
+        threats = []
+        for move in moves:
+            x = unpack_move_x(move)
+            y = unpack_move_y(move)
+            if (is_four(board, x, y, mover.pid) or
+                    get_three_directions(board, x, y, mover.pid)):
+                threats.append(move)
+        return threats
+
+    def mid(self, board, mover, th_pn, th_dn):
+        """ Expands the node with mover to move until its numbers reach
+            a threshold. Returns (pn, dn).
+        """
+        self.nodes += 1
+        key = self.get_key(board, mover)
+        attacking = mover is self.attacker
+        if is_won(board, mover.get_next().pid):
+            # the last move made five.
+            if attacking:
+                (pn, dn) = (PN_INFINITY, 0)
+            else:
+                (pn, dn) = (0, PN_INFINITY)
+            self.table.store(key, pn, dn)
+            return (pn, dn)
+        moves = self.get_moves(board, mover)
+        if moves is None:
+            # mover completes five, or the other side does next.
+            won = len(get_recent_five_cells(board, PNS_HISTORY, mover.pid)) > 0
+            if won == attacking:
+                (pn, dn) = (0, PN_INFINITY)
+            else:
+                (pn, dn) = (PN_INFINITY, 0)
+            self.table.store(key, pn, dn)
+            return (pn, dn)
+        if not moves:
+            # the attacker ran out of threats, or the board is full.
+            self.table.store(key, PN_INFINITY, 0)
+            return (PN_INFINITY, 0)
+
+        # the child searched last and its numbers, in case its slot in
+        # the table was taken since, which would send the search back
+        # into it for ever.
+        searched = NO_MOVE
+        searched_pn = 1
+        searched_dn = 1
+        while True:
+            # the numbers from the children's, and the child to go into.
+            pn = PN_INFINITY
+            dn = PN_INFINITY
+            if attacking:
+                dn = 0
+            else:
+                pn = 0
+            best = NO_MOVE
+            best_pn = 0
+            best_dn = 0
+            second = PN_INFINITY
+            for move in moves:
+                child_pn = 1
+                child_dn = 1
+                if self.table.probe(self.get_child_key(board, move, mover)):
+                    child_pn = self.table.probed_pn
+                    child_dn = self.table.probed_dn
+                elif move == searched:
+                    child_pn = searched_pn
+                    child_dn = searched_dn
+                if attacking:
+                    dn = add_numbers(dn, child_dn)
+                    if child_pn < pn:
+                        second = pn
+                        pn = child_pn
+                        best = move
+                        best_pn = child_pn
+                        best_dn = child_dn
+                    elif child_pn < second:
+                        second = child_pn
+                else:
+                    pn = add_numbers(pn, child_pn)
+                    if child_dn < dn:
+                        second = dn
+                        dn = child_dn
+                        best = move
+                        best_pn = child_pn
+                        best_dn = child_dn
+                    elif child_dn < second:
+                        second = child_dn
+            self.table.store(key, pn, dn)
+            if (pn >= th_pn or dn >= th_dn or pn == 0 or dn == 0 or
+                    self.nodes >= self.node_limit):
+                return (pn, dn)
+            if attacking:
+                child_th_pn = min(th_pn, add_numbers(second, 1))
+                child_th_dn = add_numbers(th_dn - dn, best_dn)
+            else:
+                child_th_pn = add_numbers(th_pn - pn, best_pn)
+                child_th_dn = min(th_dn, add_numbers(second, 1))
+            x = unpack_move_x(best)
+            y = unpack_move_y(best)
+            board.put_at(x, y, mover)
+            (searched_pn, searched_dn) = self.mid(board, mover.get_next(),
+                                                  child_th_pn, child_th_dn)
+            searched = best
+            board.unmake_at(x, y)
+
+    def get_proof_line(self, board):
+        """ Follows proven children from the root down: the attacker's
+            winning moves and the defender's replies.
+        """
+        line = []
+        mover = self.attacker
+        while True:
+            wins = get_recent_five_cells(board, PNS_HISTORY, mover.pid)
+            if wins:
+                line.append(wins[0])
+                break
+            moves = self.get_moves(board, mover)
+            if moves is None:
+                # the defender can only block one of the fives.
+                moves = get_recent_five_cells(board, PNS_HISTORY,
+                                              mover.get_next().pid)
+            if not moves:
+                break
+            next_move = NO_MOVE
+            for move in moves:
+                if (self.table.probe(self.get_child_key(board, move, mover))
+                        and self.table.probed_pn == 0):
+                    next_move = move
+                    break
+            if next_move == NO_MOVE and mover is not self.attacker:
+                # every reply loses; any the table still holds will do.
+                next_move = moves[0]
+            if next_move == NO_MOVE:
+                break # overwritten in the table.
+            board.put_at(unpack_move_x(next_move), unpack_move_y(next_move),
+                         mover)
+            line.append(next_move)
+            mover = mover.get_next()
+        for i in xrange(len(line) - 1, -1, -1):
+            move = line[i]
+            x = unpack_move_x(move)
+            y = unpack_move_y(move)
+            if not board.is_empty(x, y):
+                board.unmake_at(x, y)
+        return line
@@ -0,0 +1,162 @@
+""" ponder.py
+
+    Pondering: searching on the opponent's time. Not RPython.
+
+    After a player moves, the reply its search expected is read from its
+    transposition table, and a background process searches the position
+    after that reply while the opponent thinks: the threat-space solver
+    first, as before any search, then iterative deepening. The table is
+    the player's SharedTranspositionTable (smp.py), so what the ponder
+    search finds stays there for the player's next search.
+
+    When the opponent plays the expected reply (a ponder hit) the ponder
+    search simply becomes the player's search: it goes on until the
+    move time, counted from when pondering started, has passed or the
+    depth cap is reached, and its move is played -- at once if the
+    opponent took longer than that. On a miss it is stopped, and the
+    player searches as usual, from a table already holding the positions
+    the two lines have in common.
+"""
+
+import ctypes
+import multiprocessing
+from time import time
+
+from model import (Player, ZOBRIST_TURN, NO_MOVE, unpack_move_x,
+                   unpack_move_y)
+from ai import Future
+from threats import ThreatSolver
+from ordering import MoveOrderer
+from smp import SharedStopState
+
+def _ponder_main(board, pid, max_depth, ttable, options, stop_flag, result):
+    # forked with the expected reply on the board, a private copy.
+    player = Player.cache[pid]
+    (use_tss, algorithm, use_quiescence, use_null_move, use_lmr,
+     use_extensions) = options
+    state = SharedStopState(ttable, MoveOrderer(), stop_flag)
+    if use_tss:
+        line = ThreatSolver().solve(board, player, state)
+        if line is not None:
+            result[0] = line[0]
+            result[4] = len(line)
+            return
+        if state.stopped:
+            return
+    state.algorithm = algorithm
+    state.use_quiescence = use_quiescence
+    state.use_null_move = use_null_move
+    state.use_lmr = use_lmr
+    state.use_extensions = use_extensions
+    state.new_search()
+    future = Future(board, player, state)
+    value = future.iterative_deepening(max_depth, player)
+    result[0] = future.get_packed_move()
+    result[1] = state.completed_depth
+    result[2] = value
+    result[3] = state.nodes
+
+class Ponderer(object):
+    """ Ponders for one player over its shared table. start() after the
+        player's move, finish() before its next one.
+    """
+    def __init__(self, ttable):
+        self.ttable = ttable
+        self.stop_flag = multiprocessing.RawValue(ctypes.c_int, 0)
+        # move, completed depth, value and nodes of the ponder search,
+        # and the length of the forced win the threat solver found.
+        self.result = multiprocessing.RawArray(ctypes.c_longlong, 5)
+        self.process = None
+        self.expected = NO_MOVE
+        self.start_time = 0.0
+        self.hits = 0
+        self.misses = 0
+        # the ponder search's results, after a hit.
+        self.move = None
+        self.completed_depth = 0
+        self.value = 0
+        self.nodes = 0
+        self.win_length = 0
+        self.elapsed = 0.0
+
+    def get_expected_reply(self, board, opponent):
+        """ The table's best move for opponent on the board, or NO_MOVE. """
+        key = board.get_hash() ^ ZOBRIST_TURN[opponent.pid]
+        if not self.ttable.probe(key):
+            return NO_MOVE
+        move = self.ttable.probed_move
+        if move == NO_MOVE or not board.is_empty(unpack_move_x(move),
+                                                 unpack_move_y(move)):
+            return NO_MOVE
+        return move
+
+    def start(self, board, player, max_depth, state, use_tss=True):
+        """ Starts pondering on the reply to player's last move, with the
+            search options of player's state; the threat solver runs
+            first, as before the usual searches, unless use_tss is False.
+            Returns False if no reply was expected.
+        """
+        opponent = player.get_next()
+        move = self.get_expected_reply(board, opponent)
+        if move == NO_MOVE:
+            return False
+        x = unpack_move_x(move)
+        y = unpack_move_y(move)
+        options = (use_tss, state.algorithm, state.use_quiescence,
+                   state.use_null_move, state.use_lmr, state.use_extensions)
+        self.stop_flag.value = 0
+        for i in xrange(len(self.result)):
+            self.result[i] = 0
+        self.result[0] = NO_MOVE
+        board.put_at(x, y, opponent)
+        try:
+            self.process = multiprocessing.Process(
+                    target=_ponder_main,
+                    args=(board, player.pid, max_depth, self.ttable, options,
+                          self.stop_flag, self.result))
+            self.process.daemon = True
+            self.process.start()
+        finally:
+            board.unmake_at(x, y)
+        self.expected = move
+        self.start_time = time()
+        return True
+
+    def stop(self):
+        if self.process is not None:
+            self.stop_flag.value = 1
+            self.process.join()
+            self.process = None
+
+    def finish(self, board, move_time=0):
+        """ Ends pondering now that the opponent has moved. On a hit,
+            waits for the ponder search (see the module docstring) and
+            returns True with its move in self.move.
+        """
+        if self.process is None:
+            return False
+        hit = board.get_last_move() == self.expected
+        if hit and move_time > 0:
+            remaining = self.start_time + move_time / 1000.0 - time()
+            if remaining > 0.0:
+                self.process.join(remaining)
+        elif hit:
+            self.process.join()
+        self.stop()
+        self.expected = NO_MOVE
+        self.elapsed = time() - self.start_time
+        self.move = None
+        if not hit:
+            self.misses += 1
+            return False
+        self.hits += 1
+        move = self.result[0]
+        self.completed_depth = self.result[1]
+        self.value = self.result[2]
+        self.nodes = self.result[3]
+        self.win_length = self.result[4]
+        if move == NO_MOVE or (self.completed_depth == 0 and
+                               self.win_length == 0):
+            return False # stopped before depth 1 finished.
+        self.move = [unpack_move_x(move), unpack_move_y(move)]
+        return True
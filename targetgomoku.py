@@ -5,47 +5,253 @@
 """
 import __pypy_path__
 from pypy.rlib.objectmodel import we_are_translated
+from time import time
 
 from board import Board
-from model import circle
-from ai import Future
-from visualize import visualize_board, visualize_stat
+from model import (circle, PLAYER_COUNT, BOARD_SIZE, TranspositionTable,
+                   unpack_move_x, unpack_move_y)
+from ai import (Future, SearchState, MAX_SEARCH_DEPTH, INFINITY,
+                SEARCH_NAMES)
+from ordering import MoveOrderer
+from patterns import PatternEvaluator
+from threats import ThreatSolver
+from mcts import MCTSSearch, MCTS_ITERATIONS
+from visualize import (visualize_board, visualize_stat, visualize_search,
+                       visualize_mcts, visualize_ponder, visualize_threats)
+
+def parse_args(argv):
+    """ Splits argv into positional arguments and --name=value options. """
+    args = []
+    options = {}
+    for arg in argv:
+        if arg.startswith('--'):
+            eq = arg.find('=')
+            if eq < 0:
+                options[arg[2:]] = ''
+            else:
+                options[arg[2:eq]] = arg[eq + 1:]
+        else:
+            args.append(arg)
+    return args, options
+
+def get_int_option(options, name, default):
+    try:
+        return int(options[name])
+    except (KeyError, ValueError):
+        return default
+
+def get_time_left(move_time, move_start):
+    """ What is left of move_time milliseconds since move_start, at
+        least 1; 0 (no limit) stays 0.
+    """
+    if move_time <= 0:
+        return 0
+    return max(1, move_time - int((time() - move_start) * 1000))
+
+# The threat solver may take up to 1/TSS_TIME_SHARE of the move time.
+TSS_TIME_SHARE = 2
+
+_running_states = []
+
+def _request_stop(signum, frame):
+    for state in _running_states:
+        state.request_stop()
 
 def main(argv):
+    """ Usage: targetgomoku [search_depth [round_limit]] [--movetime=MS]
+                            [--eval=groups|pattern|numpy] [--threads=N]
+                            [--size=N] [--search=alphabeta|pvs|mtdf|mcts]
+                            [--playouts=N]
+                            [--tss=0] [--quiescence=0] [--nullmove=1]
+                            [--lmr=1] [--extensions=1] [--ponder=1]
+
+        With --movetime each move is searched by iterative deepening
+        until MS milliseconds have passed; search_depth then caps the
+        depth (unlimited by default).
+        --eval picks the heuristic: the piece groups' (default), the
+        line-pattern table of patterns.py or, untranslated only, the
+        NumPy kernel of npeval.py.
+        --threads=N runs a lazy SMP search over N processes sharing one
+        transposition table (smp.py), untranslated only.
+        --size=N plays on an N x N board (19 by default, at most 63).
+        --search picks the search: alpha-beta (default), principal
+        variation search (with aspiration windows under --movetime),
+        MTD(f) or Monte Carlo tree search (mcts.py). MCTS runs
+        --playouts iterations a move (1000 by default), or less when
+        --movetime runs out first, and ignores search_depth.
+        Before each search the threat-space solver (threats.py) looks
+        for a forced win by fours and threes and plays it straight
+        away; --tss=0 turns it off. Under --movetime it may take half of
+        the move time, and the search gets the rest.
+        The searches extend their leaves with forcing moves (fives and
+        the blocks of fours) in a quiescence search; --quiescence=0
+        turns it off.
+        --nullmove=1 and --lmr=1 turn on null-move pruning and late move
+        reductions in alpha-beta, and --extensions=1 searches fours,
+        open threes and forced blocks deeper there.
+        --ponder=1 has each player search the reply it expects while the
+        other one thinks (ponder.py), untranslated only and not with
+        MCTS. When the reply comes, the move is played from that search.
+    """
+    argv, options = parse_args(argv)
+    move_time = get_int_option(options, 'movetime', 0)
+    threads = get_int_option(options, 'threads', 1)
+    use_tss = get_int_option(options, 'tss', 1) != 0
+    use_quiescence = get_int_option(options, 'quiescence', 1) != 0
+    use_null_move = get_int_option(options, 'nullmove', 0) != 0
+    use_lmr = get_int_option(options, 'lmr', 0) != 0
+    use_extensions = get_int_option(options, 'extensions', 0) != 0
+    use_ponder = get_int_option(options, 'ponder', 0) != 0
+    playouts = get_int_option(options, 'playouts', MCTS_ITERATIONS)
+    size = get_int_option(options, 'size', BOARD_SIZE)
+    if not 5 <= size <= 63:
+        print 'board size must be within 5 .. 63'
+        return 1
+
     try:
         search_depth = int(argv[1])
     except (IndexError, ValueError):
-        search_depth = 4
+        if move_time > 0:
+            search_depth = MAX_SEARCH_DEPTH
+        else:
+            search_depth = 4
 
     try:
         round_limit = int(argv[2])
     except (IndexError, ValueError):
         round_limit = 99999
 
-    board = Board()
-    board.put_at(10, 10, circle)
+    board = Board(size)
+    evaluator = options.get('eval', 'groups')
+    if evaluator == 'pattern':
+        board.set_evaluator(PatternEvaluator())
+    elif evaluator == 'numpy' and not we_are_translated():
+        from npeval import NumpyEvaluator
+        board.set_evaluator(NumpyEvaluator())
+    # just off the centre, (10, 10) on the usual 19x19.
+    board.put_at(size // 2 + 1, size // 2 + 1, circle)
     player = circle.get_next()
+    # one table per player, kept across moves -- entries hold values from
+    # that player's view.
+    states = [SearchState(TranspositionTable(), MoveOrderer())
+              for _ in xrange(PLAYER_COUNT)]
+    smp_searchers = None
+    if threads > 1 and not we_are_translated():
+        from smp import LazySMPSearch
+        smp_searchers = [LazySMPSearch(threads) for _ in xrange(PLAYER_COUNT)]
+        states = [searcher.state for searcher in smp_searchers]
+    solver = ThreatSolver()
+    algorithm = options.get('search', SEARCH_NAMES[0])
+    mcts_searchers = None
+    if algorithm == 'mcts':
+        # one tree per player, each following the game from its moves.
+        mcts_searchers = [MCTSSearch(playouts) for _ in xrange(PLAYER_COUNT)]
+    ponderers = None
+    if use_ponder and mcts_searchers is None and not we_are_translated():
+        from ponder import Ponderer
+        if smp_searchers is None:
+            # the ponder process fills the table the next search reads.
+            from smp import SharedTranspositionTable
+            states = [SearchState(SharedTranspositionTable(), MoveOrderer())
+                      for _ in xrange(PLAYER_COUNT)]
+        ponderers = [Ponderer(state.ttable) for state in states]
+    for state in states:
+        if algorithm in SEARCH_NAMES:
+            state.algorithm = SEARCH_NAMES.index(algorithm)
+        state.use_quiescence = use_quiescence
+        state.use_null_move = use_null_move
+        state.use_lmr = use_lmr
+        state.use_extensions = use_extensions
+    if not we_are_translated():
+        # stop the search cleanly on ^C and play the best move so far.
+        import signal
+        _running_states[:] = states
+        signal.signal(signal.SIGINT, _request_stop)
 
     try:
         for _ in xrange(round_limit):
-            future = Future(board, player)
-            # w/pruning.
-            hval = future.alphabeta(search_depth,
-                                    -(1 << 60), (1 << 60), player)
+            move_start = time()
+            state = states[player.pid]
+            future = Future(board, player, state)
+            line = None
+            pondered = False
+            if ponderers is not None:
+                ponderer = ponderers[player.pid]
+                pondered = ponderer.finish(board, move_time)
+            if use_tss and not pondered:
+                # the solver gets a share of the move time, the search
+                # what is left of it.
+                state.start_timer(move_time // TSS_TIME_SHARE)
+                line = solver.solve(board, player, state)
+            if pondered:
+                # ponder hit -- its threat solver has run, too.
+                if ponderer.win_length > 0:
+                    print 'forced win in %d moves' % (
+                            (ponderer.win_length + 1) // 2)
+                    hval = INFINITY
+                else:
+                    hval = ponderer.value
+                future.move = ponderer.move
+            elif line is not None:
+                print 'forced win in %d moves' % ((len(line) + 1) // 2)
+                future.move = [unpack_move_x(line[0]), unpack_move_y(line[0])]
+                hval = INFINITY
+            elif mcts_searchers is not None:
+                mcts_searcher = mcts_searchers[player.pid]
+                mcts_searcher.search(board, player,
+                                     get_time_left(move_time, move_start))
+                future.move = mcts_searcher.move
+                hval = 0
+            elif smp_searchers is not None:
+                searcher = smp_searchers[player.pid]
+                hval = searcher.search(board, player, search_depth,
+                                       get_time_left(move_time, move_start))
+                future.move = searcher.move
+            elif move_time > 0:
+                state.new_search()
+                state.start_timer(get_time_left(move_time, move_start))
+                hval = future.iterative_deepening(search_depth, player)
+            else:
+                # w/pruning.
+                state.new_search()
+                hval = future.search(search_depth,
+                                     -INFINITY, INFINITY, player)
+                state.completed_depth = search_depth
+            if future.move is None:
+                break # stopped before any move was found.
             (x, y) = future.move
             board.put_at(x, y, player)
+            won = board.is_win_at(x, y)
             visualize_board(board)
             visualize_stat(board, player, x, y, hval)
+            if mcts_searchers is not None and line is None:
+                visualize_mcts(mcts_searchers[player.pid])
+            elif pondered:
+                visualize_ponder(ponderer)
+            elif line is not None:
+                visualize_threats(solver)
+            else:
+                visualize_search(state)
             # test for winner
-            if board.piece_groups[player.pid].count_of(5) != 0:
+            if won:
                 print 'player %s wins' % player.name
                 break
+            if state.stop_requested:
+                print 'search stopped'
+                break
+            if ponderers is not None:
+                ponderers[player.pid].start(board, player, search_depth,
+                                            state, use_tss)
             player = player.get_next()
     except KeyboardInterrupt:
         if we_are_translated():
             pass
         else:
             raise
+    finally:
+        if ponderers is not None:
+            for ponderer in ponderers:
+                ponderer.stop()
     return 0
 
 def target(driver, argl):
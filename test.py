@@ -1,9 +1,24 @@
-from unittest import TestCase
-from random import shuffle
+import sys
+from StringIO import StringIO
+from unittest import TestCase, skipIf
+from random import shuffle, Random
 
 from board import Board
-from model import circle, cross, SmallSet
-from pieces import HVALTAB
+from bitboard import BitBoard
+from model import (circle, cross, SmallSet, BitSet, TranspositionTable,
+                   pack_move, unpack_move_x, unpack_move_y, NO_MOVE)
+from pieces import HVALTAB, HVALTAB2
+from ai import (Future, SearchState, INFINITY, FOUR_EXTENSION,
+                THREE_EXTENSION, MAX_LINE_EXTENSIONS, SEARCH_ALPHABETA,
+                SEARCH_PVS, SEARCH_MTDF, TIME_CHECK_INTERVAL)
+from ordering import MoveOrderer
+from patterns import PatternEvaluator
+from threats import ThreatSolver
+from mcts import MCTSSearch
+from pns import (ProofNumberSearch, ProofTable, PN_INFINITY, PNS_WIN,
+                 PNS_NO_WIN, PNS_UNSOLVED)
+from visualize import visualize_stat
+import npeval
 
 p1 = circle
 p2 = cross
@@ -392,6 +407,28 @@ class TestBoardModel_WithAddingInVertical(_grouptest_base):
 
 del _grouptest_base
 
+class TestBitSet(TestCase):
+    def test_put_del_across_words(self):
+        bs = BitSet(51 * 51)
+        members = [0, 31, 32, 33, 63, 64, 1000, 51 * 51 - 1]
+        for nth in members:
+            bs.put_at(nth)
+        self.assertEquals(bs.count(), len(members))
+        self.assertEquals(bs.to_list(), members)
+        self.assertTrue(bs.get_at(32))
+        self.assertFalse(bs.get_at(34))
+        bs.del_at(32)
+        self.assertFalse(bs.get_at(32))
+        self.assertTrue(bs.get_at(31) and bs.get_at(33))
+
+    def test_copy_and_clear(self):
+        bs = BitSet(100)
+        bs.put_at(70)
+        copy = bs.make_copy()
+        bs.clear()
+        self.assertEquals(bs.to_list(), [])
+        self.assertEquals(copy.to_list(), [70])
+
 class TestSmallSet(TestCase):
     def setUp(self):
         self.ss = SmallSet(19)
@@ -426,3 +463,1009 @@ class TestSmallSet(TestCase):
         self.assertEquals(len(lis), 19 * 19)
         self.assertEquals(lis, reference)
 
+    def test_to_list_and_count(self):
+        cells = [(18, 0), (0, 3), (5, 3), (17, 3), (9, 18)]
+        for (x, y) in cells:
+            self.ss.put_at(x, y)
+        self.assertEquals(self.ss.count(), len(cells))
+        self.assertEquals(self.ss.to_list(),
+                          [pack_move(x, y) for (x, y) in cells])
+        lis = []
+        it = self.ss.get_iterator()
+        while it.has_next():
+            lis.append(it.get_next())
+        self.assertEquals(lis, cells)
+        self.assertEquals(SmallSet(19).count(), 0)
+
+
+# A small middle-game position used by the search tests.
+SEARCH_POSITION = [
+    (9, 9, p1), (10, 10, p2), (9, 10, p1), (10, 9, p2),
+    (8, 11, p1), (11, 8, p2), (9, 8, p1),
+]
+
+def make_search_board(board_class=Board):
+    board = board_class()
+    for (x, y, p) in SEARCH_POSITION:
+        board.put_at(x, y, p)
+    return board
+
+def make_threat_board(attacker_pts, defender_pts):
+    """ A Board with p1 (the attacker) at attacker_pts and p2 at
+        defender_pts.
+    """
+    board = Board()
+    for (x, y) in attacker_pts:
+        board.put_at(x, y, p1)
+    for (x, y) in defender_pts:
+        board.put_at(x, y, p2)
+    return board
+
+class TestZobristHash(TestCase):
+    def test_hash_restored_by_del_at(self):
+        board = make_search_board()
+        saved = board.get_hash()
+        board.put_at(3, 3, p2)
+        self.assertNotEquals(board.get_hash(), saved)
+        board.del_at(3, 3)
+        self.assertEquals(board.get_hash(), saved)
+
+    def test_hash_ignores_move_order(self):
+        board = make_search_board()
+        moves = SEARCH_POSITION[:]
+        shuffle(moves)
+        other = Board()
+        for (x, y, p) in moves:
+            other.put_at(x, y, p)
+        self.assertEquals(board.get_hash(), other.get_hash())
+
+    def test_hash_depends_on_owner(self):
+        b1 = Board()
+        b1.put_at(5, 5, p1)
+        b2 = Board()
+        b2.put_at(5, 5, p2)
+        self.assertNotEquals(b1.get_hash(), b2.get_hash())
+
+class TestTranspositionTable(TestCase):
+    def search(self, state, depth=4):
+        future = Future(make_search_board(), p2, state)
+        value = future.alphabeta(depth, -(1 << 60), (1 << 60), p2)
+        return value, future
+
+    def test_same_value_as_plain_search(self):
+        plain_value, _ = self.search(SearchState())
+        state = SearchState(TranspositionTable(size_bits=12))
+        tt_value, future = self.search(state)
+        self.assertEquals(tt_value, plain_value)
+        self.assertTrue(future.move is not None)
+        self.assertTrue(state.ttable.hits > 0)
+
+    def test_fewer_nodes_with_table(self):
+        plain = SearchState()
+        self.search(plain)
+        cached = SearchState(TranspositionTable(size_bits=12))
+        self.search(cached)
+        self.assertTrue(cached.nodes < plain.nodes)
+
+class TestIterativeDeepening(TestCase):
+    def test_reaches_max_depth_without_deadline(self):
+        state = SearchState(TranspositionTable(size_bits=12))
+        future = Future(make_search_board(), p2, state)
+        value = future.iterative_deepening(2, p2)
+        self.assertEquals(state.completed_depth, 2)
+        plain = Future(make_search_board(), p2)
+        self.assertEquals(value, plain.alphabeta(2, -(1 << 60), (1 << 60), p2))
+        self.assertTrue(future.move is not None)
+
+    def test_stop_flag_keeps_a_move(self):
+        state = SearchState()
+        state.request_stop()
+        future = Future(make_search_board(), p2, state)
+        future.iterative_deepening(4, p2)
+        self.assertEquals(state.completed_depth, 0)
+        x, y = future.move
+        self.assertTrue(future.board.get_at(x, y) is None)
+
+    def test_deadline_stops_one_search(self):
+        state = SearchState()
+        state.deadline = 1.0 # long passed.
+        future = Future(make_search_board(), p2, state)
+        future.iterative_deepening(4, p2)
+        self.assertTrue(state.stopped)
+        state.new_search()
+        state.start_timer(0)
+        future.iterative_deepening(1, p2)
+        self.assertFalse(state.stopped)
+        self.assertEquals(state.completed_depth, 1)
+        state.request_stop()
+        state.new_search()
+        self.assertTrue(state.stopped)
+
+    def test_quiescence_looks_at_the_clock(self):
+        state = SearchState()
+        state.deadline = 1.0 # long passed.
+        state.qnodes = TIME_CHECK_INTERVAL - 1
+        future = Future(make_search_board(), p2, state)
+        future.quiesce(-INFINITY, INFINITY, p2)
+        self.assertTrue(state.stopped)
+        self.assertEquals(state.qnodes, TIME_CHECK_INTERVAL)
+
+class TestMoveOrdering(TestCase):
+    def search(self, state, depth=3):
+        future = Future(make_search_board(), p2, state)
+        return future.alphabeta(depth, -(1 << 60), (1 << 60), p2)
+
+    def test_same_value_fewer_nodes(self):
+        raster = SearchState()
+        ordered = SearchState(orderer=MoveOrderer())
+        self.assertEquals(self.search(ordered), self.search(raster))
+        self.assertTrue(ordered.nodes < raster.nodes)
+        self.assertTrue(ordered.cutoffs > 0)
+
+    def test_hash_move_and_killers_first(self):
+        board = make_search_board()
+        orderer = MoveOrderer()
+        orderer.record_cutoff(pack_move(8, 10), 2, 1, p1)
+        moves = orderer.order(board, board.get_possible_moves(), 1, p1,
+                              pack_move(12, 7))
+        self.assertEquals(moves[0], pack_move(12, 7))
+        self.assertEquals(moves[1], pack_move(8, 10))
+
+    def test_only_new_search_ages_history(self):
+        state = SearchState(orderer=MoveOrderer())
+        state.orderer.record_cutoff(pack_move(8, 10), 4, 1, p1)
+        state.nodes = 5
+        state.reset_counters()
+        self.assertEquals(state.nodes, 0)
+        self.assertEquals(state.orderer.history[p1.pid][pack_move(8, 10)], 16)
+        state.new_search()
+        self.assertEquals(state.orderer.history[p1.pid][pack_move(8, 10)], 8)
+
+def play_random_moves(board, count, rand):
+    """ Plays count random moves next to the existing pieces and returns
+        them as (x, y) pairs.
+    """
+    moves = []
+    player = p1
+    for _ in xrange(count):
+        candidates = []
+        pm_iter = board.get_possible_moves().get_iterator()
+        while pm_iter.has_next():
+            candidates.append(pm_iter.get_next())
+        if not candidates:
+            candidates = [(9, 9)]
+        (x, y) = candidates[rand.randrange(len(candidates))]
+        board.put_at(x, y, player)
+        moves.append((x, y))
+        player = player.get_next()
+    return moves
+
+class TestIncrementalHval(TestCase):
+    def assert_hvals_match(self, board):
+        for group_man in board.get_piece_groups():
+            self.assertEquals(group_man.get_hval(),
+                              group_man.compute_hval(board))
+
+    def test_random_games(self):
+        rand = Random(42)
+        for _ in xrange(20):
+            board = Board()
+            moves = play_random_moves(board, 30, rand)
+            self.assert_hvals_match(board)
+            rand.shuffle(moves)
+            for (x, y) in moves[:15]:
+                board.del_at(x, y)
+                self.assert_hvals_match(board)
+
+    def test_blocked_by_enemy(self):
+        board = Board()
+        board.put_at(5, 5, p1)
+        board.put_at(6, 5, p1)
+        open_hval = board.get_hval(p1.pid)
+        board.put_at(7, 5, p2)
+        self.assertTrue(board.get_hval(p1.pid) < open_hval)
+        board.del_at(7, 5)
+        self.assertEquals(board.get_hval(p1.pid), open_hval)
+
+class TestUndoLog(TestCase):
+    def test_unmake_restores_possible_moves(self):
+        rand = Random(7)
+        for board_class in (Board, BitBoard):
+            board = board_class()
+            play_random_moves(board, 10, rand)
+            before = board.get_possible_moves().data[:]
+            moves = play_random_moves(board, 10, rand)
+            moves.reverse()
+            for (x, y) in moves:
+                board.unmake_at(x, y)
+            self.assertEquals(board.get_possible_moves().data, before)
+            self.assertEquals(len(board.pm_marks), 10)
+
+    def test_del_at_keeps_the_log_in_step(self):
+        for board_class in (Board, BitBoard):
+            expected = board_class()
+            expected.put_at(9, 9, p1)
+            board = board_class()
+            board.put_at(9, 9, p1)
+            board.put_at(10, 10, p2)
+            board.put_at(5, 5, p1)
+            board.del_at(5, 5)
+            board.unmake_at(10, 10)
+            self.assertEquals(board.get_possible_moves().data,
+                              expected.get_possible_moves().data)
+            # (3, 3)'s changes go with (9, 9)'s, the move before it.
+            board.put_at(3, 3, p2)
+            board.put_at(14, 14, p1)
+            board.del_at(3, 3)
+            self.assertEquals(len(board.pm_marks), len(board.history))
+            board.unmake_at(14, 14)
+            board.unmake_at(9, 9)
+            self.assertEquals(board.get_possible_moves().data,
+                              board_class().get_possible_moves().data)
+
+    def test_search_leaves_board_unchanged(self):
+        board = make_search_board()
+        before = board.get_possible_moves().data[:]
+        log_length = len(board.pm_log)
+        board_hash = board.get_hash()
+        future = Future(board, p2, SearchState(TranspositionTable(),
+                                               MoveOrderer()))
+        future.alphabeta(3, -INFINITY, INFINITY, p2)
+        self.assertEquals(board.get_possible_moves().data, before)
+        self.assertEquals(board.get_hash(), board_hash)
+        self.assertEquals(len(board.pm_log), log_length)
+
+def describe_groups(board):
+    """ The board's groups as sorted (pid, direction, cells) tuples. """
+    res = []
+    for group_man in board.get_piece_groups():
+        for groups in group_man.get_groups():
+            for group in groups:
+                cells = sorted([(p.x, p.y) for p in group.pieces])
+                res.append((group.get_owner().pid, group.direction,
+                            cells, group.hval))
+    res.sort()
+    return res
+
+class TestGroupJournal(TestCase):
+    def test_lifo_delete_restores_groups(self):
+        rand = Random(11)
+        for _ in xrange(10):
+            board = Board()
+            play_random_moves(board, 20, rand)
+            before = describe_groups(board)
+            hvals = [board.get_hval(pid) for pid in xrange(2)]
+            moves = play_random_moves(board, 12, rand)
+            moves.reverse()
+            for (x, y) in moves:
+                board.del_at(x, y)
+            self.assertEquals(describe_groups(board), before)
+            self.assertEquals([board.get_hval(pid) for pid in xrange(2)],
+                              hvals)
+            for x in xrange(board.size):
+                for y in xrange(board.size):
+                    piece = board.get_at(x, y)
+                    if piece:
+                        for group in piece.groups:
+                            self.assertTrue(piece in group.pieces)
+                            self.assert_bounds_cached(group)
+
+    def assert_bounds_cached(self, group):
+        xs = [p.x for p in group.pieces]
+        ys = [p.y for p in group.pieces]
+        self.assertEquals(group.get_length(), len(group.pieces))
+        self.assertEquals((group.get_min_x(), group.get_max_x()),
+                          (min(xs), max(xs)))
+        self.assertEquals((group.get_min_y(), group.get_max_y()),
+                          (min(ys), max(ys)))
+
+    def test_out_of_order_delete_falls_back(self):
+        rand = Random(12)
+        board = Board()
+        plain = Board()
+        plain.use_journal = False
+        moves = play_random_moves(board, 25, rand)
+        for (x, y) in moves:
+            plain.put_at(x, y, board.get_owner_at(x, y))
+        rand.shuffle(moves)
+        for (x, y) in moves[:12]:
+            board.del_at(x, y)
+            plain.del_at(x, y)
+            self.assertEquals(describe_groups(board), describe_groups(plain))
+        self.assertEquals(board.group_marks, [])
+
+class TestPieceGroupManager(TestCase):
+    def test_swap_remove_keeps_indexes(self):
+        rand = Random(13)
+        board = Board()
+        moves = play_random_moves(board, 40, rand)
+        rand.shuffle(moves)
+        for (x, y) in moves[:25]:
+            board.del_at(x, y)
+            for group_man in board.get_piece_groups():
+                for length in xrange(len(group_man.get_groups())):
+                    groups = group_man.get_groups()[length]
+                    self.assertEquals(group_man.count_of(length),
+                                      len(groups))
+                    for i in xrange(len(groups)):
+                        self.assertEquals(groups[i].manager_index, i)
+                        self.assertEquals(groups[i].get_length(), length)
+
+class TestBoardSizes(TestCase):
+    def test_random_games(self):
+        rand = Random(15)
+        for size in (15, 31, 51):
+            board = Board(size)
+            bitboard = BitBoard(size)
+            board.put_at(size // 2, size // 2, p1)
+            bitboard.put_at(size // 2, size // 2, p1)
+            for (x, y) in play_random_moves(board, 30, rand):
+                bitboard.put_at(x, y, board.get_owner_at(x, y))
+            self.assertEquals(board.get_hash(), bitboard.get_hash())
+            self.assertEquals(board.get_possible_moves().data,
+                              bitboard.get_possible_moves().data)
+            for pid in xrange(2):
+                self.assertEquals(board.get_hval(pid),
+                                  board.piece_groups[pid].compute_hval(board))
+
+    def test_corner_neighbours(self):
+        board = Board(31)
+        board.put_at(30, 30, p1)
+        self.assertEquals(board.get_possible_moves().count(), 3)
+
+class TestWinDetection(TestCase):
+    def test_five_and_overline(self):
+        for board_class in (Board, BitBoard):
+            board = board_class()
+            for x in (3, 4, 6, 7):
+                board.put_at(x, 8, p1)
+            board.put_at(9, 8, p1)
+            self.assertFalse(board.last_move_wins())
+            # 3..7 is five, and 8 joins it with 9 into an overline.
+            board.put_at(5, 8, p1)
+            self.assertTrue(board.last_move_wins())
+            self.assertTrue(board.is_win_at(3, 8))
+            board.put_at(8, 8, p1)
+            self.assertTrue(board.is_win_at(8, 8))
+            board.unmake_at(8, 8)
+            board.unmake_at(5, 8)
+            self.assertFalse(board.last_move_wins())
+            self.assertEquals(board.get_last_move(), pack_move(9, 8))
+
+    def test_diagonal_up_at_edge(self):
+        board = Board(15)
+        for i in xrange(5):
+            board.put_at(10 + i, 4 - i, p2)
+        self.assertTrue(board.is_win_at(14, 0))
+        self.assertTrue(board.is_win_at(12, 2))
+        self.assertFalse(board.is_win_at(0, 0))
+
+    def test_matches_group_count(self):
+        rand = Random(16)
+        for _ in xrange(20):
+            board = Board()
+            for (x, y) in play_random_moves(board, 40, rand):
+                # only the move that made it can have made a five, and
+                # overlines aren't length-5 groups.
+                if board.is_win_at(x, y):
+                    break
+            owner = board.get_owner_at(x, y)
+            self.assertEquals(board.is_win_at(x, y),
+                              board.has_five(owner.pid) or
+                              board.piece_groups[owner.pid].count_of(6) +
+                              board.piece_groups[owner.pid].count_of(7) +
+                              board.piece_groups[owner.pid].count_of(8) > 0)
+
+    def test_overline_stats(self):
+        board = Board()
+        for x in xrange(3, 9):
+            board.put_at(x, 5, p1)
+        self.assertTrue(board.is_win_at(8, 5))
+        saved = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            visualize_stat(board, p1, 8, 5, 0)
+            out = sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+        self.assertTrue('five x 1' in out)
+
+class TestPrincipalVariationSearch(TestCase):
+    def search(self, board, player, depth, algorithm, deepening):
+        state = SearchState(orderer=MoveOrderer())
+        state.algorithm = algorithm
+        state.new_search()
+        future = Future(board, player, state)
+        if deepening:
+            value = future.iterative_deepening(depth, player)
+        else:
+            value = future.search(depth, -INFINITY, INFINITY, player)
+        return (value, state)
+
+    def test_same_value_as_alphabeta(self):
+        rand = Random(17)
+        for _ in xrange(4):
+            board = Board()
+            board.put_at(9, 9, p1)
+            moves = play_random_moves(board, 6, rand)
+            player = p2
+            if len(moves) % 2:
+                player = p1
+            for deepening in (False, True):
+                (ab_value, _) = self.search(board, player, 3,
+                                            SEARCH_ALPHABETA, deepening)
+                (pvs_value, _) = self.search(board, player, 3,
+                                             SEARCH_PVS, deepening)
+                self.assertEquals(pvs_value, ab_value)
+
+    def test_negamax_view_of_other_mover(self):
+        board = make_search_board()
+        state = SearchState(orderer=MoveOrderer())
+        state.algorithm = SEARCH_PVS
+        value = Future(board, p1, state).search(2, -INFINITY, INFINITY, p2)
+        expected = Future(board, p1, SearchState(
+                orderer=MoveOrderer())).alphabeta(2, -INFINITY, INFINITY, p2)
+        self.assertEquals(value, expected)
+
+class TestMTDF(TestCase):
+    def test_converges_to_alphabeta_value(self):
+        rand = Random(18)
+        for _ in xrange(4):
+            board = Board()
+            board.put_at(9, 9, p1)
+            moves = play_random_moves(board, 7, rand)
+            player = p2
+            if len(moves) % 2:
+                player = p1
+            expected = Future(board, player, SearchState(
+                    orderer=MoveOrderer())).alphabeta(3, -INFINITY,
+                                                      INFINITY, player)
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            state.algorithm = SEARCH_MTDF
+            future = Future(board, player, state)
+            self.assertEquals(future.iterative_deepening(3, player),
+                              expected)
+            self.assertTrue(board.is_empty(*future.move))
+            self.assertTrue(state.passes >= 3)
+
+class TestQuiescence(TestCase):
+    def make_board(self):
+        # p1 has a four, open at (8, 5) only.
+        board = Board()
+        for x in xrange(4, 8):
+            board.put_at(x, 5, p1)
+        for (x, y) in [(3, 5), (10, 10), (11, 11)]:
+            board.put_at(x, y, p2)
+        return board
+
+    def test_completes_five(self):
+        state = SearchState()
+        future = Future(self.make_board(), p1, state)
+        value = future.quiesce(-INFINITY, INFINITY, p1)
+        self.assertTrue(value > future.heuristic_eval())
+        self.assertTrue(value >= HVALTAB[5] - 2 * HVALTAB[4])
+        self.assertEquals(state.qnodes, 2)
+
+    def test_blocks_four(self):
+        board = self.make_board()
+        state = SearchState()
+        future = Future(board, p1, state)
+        value = future.quiesce(-INFINITY, INFINITY, p2)
+        board.put_at(8, 5, p2)
+        self.assertEquals(value, future.heuristic_eval())
+        board.unmake_at(8, 5)
+        self.assertEquals(state.qnodes, 2)
+
+    def test_node_limit(self):
+        state = SearchState()
+        state.qnode_limit = 1
+        future = Future(self.make_board(), p1, state)
+        self.assertEquals(future.quiesce(-INFINITY, INFINITY, p2),
+                          future.heuristic_eval())
+        self.assertEquals(state.qcutoffs, 1)
+
+    def test_searches_agree(self):
+        board = self.make_board()
+        board.del_at(7, 5)
+        values = []
+        for algorithm in (SEARCH_ALPHABETA, SEARCH_PVS, SEARCH_MTDF):
+            state = SearchState(TranspositionTable(), MoveOrderer())
+            state.use_quiescence = True
+            state.algorithm = algorithm
+            state.new_search()
+            future = Future(board, p2, state)
+            values.append(future.search(2, -INFINITY, INFINITY, p2))
+            self.assertTrue(state.qnodes > 0)
+        self.assertEquals(values, [values[0]] * 3)
+
+class TestSearchPruning(TestCase):
+    def search(self, use_null_move, use_lmr, depth=4):
+        state = SearchState(TranspositionTable(), MoveOrderer())
+        state.use_null_move = use_null_move
+        state.use_lmr = use_lmr
+        state.new_search()
+        future = Future(make_search_board(), p2, state)
+        future.alphabeta(depth, -INFINITY, INFINITY, p2)
+        self.assertTrue(future.board.is_empty(*future.move))
+        self.assertFalse(state.in_null_move)
+        return state
+
+    def test_switched_off(self):
+        state = self.search(False, False)
+        self.assertEquals(state.null_probes, 0)
+        self.assertEquals(state.reductions, 0)
+
+    def test_null_move(self):
+        state = self.search(True, False)
+        self.assertTrue(state.null_probes > 0)
+        self.assertTrue(state.null_cutoffs <= state.null_probes)
+        self.assertEquals(state.reductions, 0)
+
+    def test_late_move_reductions(self):
+        state = self.search(False, True)
+        self.assertTrue(state.reductions > 0)
+        self.assertTrue(state.reduction_researches <= state.reductions)
+        self.assertTrue(state.nodes < self.search(False, False).nodes)
+
+    def test_fours_are_not_reduced(self):
+        board = Board()
+        for x in xrange(4, 7):
+            board.put_at(x, 5, p1)
+        board.put_at(7, 5, p1)
+        future = Future(board, p1)
+        self.assertTrue(future.has_fours())
+        self.assertFalse(future.is_late_move(5, pack_move(7, 5), NO_MOVE,
+                                             p1))
+        board.unmake_at(7, 5)
+        board.put_at(7, 6, p1)
+        self.assertFalse(future.has_fours())
+        self.assertTrue(future.is_late_move(5, pack_move(7, 6), NO_MOVE,
+                                            p1))
+        self.assertFalse(future.is_late_move(1, pack_move(7, 6), NO_MOVE,
+                                             p1))
+
+class TestThreatExtensions(TestCase):
+    def make_board(self):
+        board = Board()
+        for (x, y) in [(5, 5), (6, 5), (7, 5)]:
+            board.put_at(x, y, p1)
+        for (x, y) in [(10, 10), (12, 11), (2, 14)]:
+            board.put_at(x, y, p2)
+        return board
+
+    def search(self, use_extensions):
+        state = SearchState(TranspositionTable(), MoveOrderer())
+        state.use_extensions = use_extensions
+        future = Future(self.make_board(), p1, state)
+        value = future.alphabeta(2, -INFINITY, INFINITY, p1)
+        self.assertEquals(state.line_extensions, 0)
+        return (value, state)
+
+    def test_open_four_is_seen_through(self):
+        (value, state) = self.search(False)
+        self.assertEquals(state.extensions, 0)
+        self.assertTrue(value < HVALTAB2[0][5])
+        (value, state) = self.search(True)
+        self.assertTrue(state.extensions > 0)
+        self.assertTrue(value > HVALTAB2[0][5] - 2 * HVALTAB2[0][4])
+
+    def test_extension_kinds(self):
+        board = self.make_board()
+        future = Future(board, p1, SearchState())
+        board.put_at(8, 5, p1)
+        self.assertEquals(future.get_extension(8, 5, pack_move(8, 5), p1,
+                                               NO_MOVE), FOUR_EXTENSION)
+        board.unmake_at(8, 5)
+        board.put_at(5, 6, p1)
+        self.assertEquals(future.get_extension(5, 6, pack_move(5, 6), p1,
+                                               NO_MOVE), 0)
+        board.put_at(5, 7, p1)
+        self.assertEquals(future.get_extension(5, 7, pack_move(5, 7), p1,
+                                               NO_MOVE), THREE_EXTENSION)
+        future.state.line_extensions = MAX_LINE_EXTENSIONS - 1
+        board.unmake_at(5, 7)
+        board.put_at(9, 5, p1)
+        self.assertEquals(future.get_extension(9, 5, pack_move(9, 5), p1,
+                                               pack_move(9, 5)), 1)
+
+class TestMCTS(TestCase):
+    def test_leaves_board_alone(self):
+        board = make_search_board()
+        stones = board.get_stones()
+        history = list(board.history)
+        pmoves = board.get_possible_moves().to_list()
+        searcher = MCTSSearch(100)
+        searcher.search(board, p2)
+        self.assertEquals(searcher.playouts, 100)
+        self.assertEquals(searcher.root.visits, 100)
+        self.assertTrue(board.is_empty(*searcher.move))
+        self.assertEquals(board.get_stones(), stones)
+        self.assertEquals(board.history, history)
+        self.assertEquals(board.get_possible_moves().to_list(), pmoves)
+
+    def test_completes_five(self):
+        board = Board()
+        for x in xrange(4, 8):
+            board.put_at(x, 5, p1)
+        for (x, y) in [(10, 10), (11, 12), (2, 14)]:
+            board.put_at(x, y, p2)
+        searcher = MCTSSearch(200)
+        searcher.search(board, p1)
+        (x, y) = searcher.move
+        board.put_at(x, y, p1)
+        self.assertTrue(board.is_win_at(x, y))
+
+    def test_reuses_tree(self):
+        board = make_search_board()
+        searcher = MCTSSearch(300)
+        searcher.search(board, p2)
+        self.assertEquals(searcher.reused_visits, 0)
+        (x, y) = searcher.move
+        board.put_at(x, y, p2)
+        # the reply visited most in the move's subtree.
+        reply = searcher.root.find_child(pack_move(x, y)).get_most_visited()
+        board.put_at(unpack_move_x(reply.move), unpack_move_y(reply.move),
+                     p1)
+        visits = reply.visits
+        searcher.search(board, p2)
+        self.assertEquals(searcher.reused_visits, visits)
+        self.assertEquals(searcher.root.visits, visits + 300)
+        # a position off the tree starts over.
+        board.put_at(0, 0, p2)
+        board.put_at(0, 1, p1)
+        searcher.search(board, p2)
+        self.assertEquals(searcher.reused_visits, 0)
+
+    def test_time_budget(self):
+        searcher = MCTSSearch(1 << 30)
+        searcher.search(make_search_board(), p2, 100)
+        self.assertTrue(0 < searcher.playouts < 1 << 30)
+        self.assertTrue(searcher.elapsed < 5.0)
+
+class TestProofNumberSearch(TestCase):
+    def make_double_three(self):
+        return make_threat_board([(5, 5), (6, 5), (7, 6), (7, 7)],
+                                 [(10, 10), (11, 12), (2, 14), (14, 2)])
+
+    def test_proves_win(self):
+        board = self.make_double_three()
+        stones = board.get_stones()
+        solver = ProofNumberSearch()
+        self.assertEquals(solver.solve(board, p1), PNS_WIN)
+        self.assertEquals(board.get_stones(), stones)
+        line = solver.line
+        self.assertEquals(line[0], pack_move(7, 5))
+        self.assertEquals(len(line) % 2, 1)
+        player = p1
+        for move in line:
+            board.put_at(unpack_move_x(move), unpack_move_y(move), player)
+            player = player.get_next()
+        self.assertTrue(board.last_move_wins())
+
+    def test_no_win(self):
+        board = make_threat_board([(9, 9), (9, 10)], [(10, 10), (10, 9)])
+        solver = ProofNumberSearch()
+        self.assertEquals(solver.solve(board, p1), PNS_NO_WIN)
+        self.assertEquals(solver.line, [])
+
+    def test_already_lost(self):
+        board = make_threat_board([(9, 9)], [(x, 3) for x in xrange(5)])
+        self.assertEquals(ProofNumberSearch().solve(board, p1), PNS_NO_WIN)
+
+    def test_node_limit(self):
+        solver = ProofNumberSearch(node_limit=5)
+        self.assertEquals(solver.solve(self.make_double_three(), p1),
+                          PNS_UNSOLVED)
+        self.assertTrue(solver.nodes <= 6)
+
+    def test_small_table(self):
+        # about as many slots as positions searched: buckets overflow,
+        # but a proof still comes out.
+        solver = ProofNumberSearch(size_bits=8)
+        self.assertEquals(solver.solve(self.make_double_three(), p1),
+                          PNS_WIN)
+        self.assertEquals(len(solver.table.keys), 256)
+
+    def test_table_keeps_solved(self):
+        table = ProofTable(4)
+        for key in (0x10, 0x20, 0x30, 0x40):
+            table.store(key, 0, PN_INFINITY)
+        table.store(0x50, 3, 2) # the bucket is full of solved ones.
+        table.store(0x60, 1, 1)
+        self.assertTrue(table.probe(0x10))
+        self.assertFalse(table.probe(0x50))
+        self.assertTrue(table.probe(0x60))
+        self.assertEquals((table.probed_pn, table.probed_dn), (1, 1))
+
+class TestThreatSolver(TestCase):
+    def assert_line_wins(self, board, line):
+        player = p1
+        for move in line:
+            (x, y) = (unpack_move_x(move), unpack_move_y(move))
+            self.assertTrue(board.is_empty(x, y))
+            board.put_at(x, y, player)
+            player = player.get_next()
+        self.assertEquals(len(line) % 2, 1)
+        self.assertTrue(board.last_move_wins())
+
+    def test_finds_continuous_fours(self):
+        board = make_threat_board([(4, 5), (5, 5), (6, 5), (7, 7), (7, 8),
+                                   (7, 9)],
+                                  [(3, 5), (7, 10), (10, 10), (11, 11),
+                                   (12, 12), (2, 2)])
+        line = ThreatSolver().solve(board, p1)
+        self.assertFalse(line is None)
+        self.assertTrue(len(line) >= 3)
+        self.assert_line_wins(board, line)
+
+    def test_open_four_wins(self):
+        board = make_threat_board([(5, 5), (6, 5), (7, 5)],
+                                  [(10, 10), (11, 12), (2, 14)])
+        line = ThreatSolver().solve(board, p1)
+        self.assertEquals(len(line), 3)
+        self.assert_line_wins(board, line)
+
+    def test_deadline_aborts(self):
+        board = make_threat_board([(5, 5), (6, 5), (7, 5)],
+                                  [(10, 10), (11, 12), (2, 14)])
+        state = SearchState()
+        state.deadline = 1.0 # long passed.
+        solver = ThreatSolver()
+        self.assertTrue(solver.solve(board, p1, state) is None)
+        self.assertTrue(solver.aborted)
+        self.assertEquals(solver.nodes, 1)
+
+    def test_double_three_needs_threes(self):
+        board = make_threat_board([(5, 5), (6, 5), (7, 6), (7, 7)],
+                                  [(10, 10), (11, 12), (2, 14), (14, 2)])
+        self.assertTrue(ThreatSolver(vct_depth=0).solve(board, p1) is None)
+        line = ThreatSolver().solve(board, p1)
+        self.assertEquals(line[0], pack_move(7, 5))
+        self.assert_line_wins(board, line)
+
+    def test_no_win_in_quiet_position(self):
+        board = make_threat_board([(9, 9), (9, 10)], [(10, 10), (10, 9)])
+        solver = ThreatSolver()
+        self.assertTrue(solver.solve(board, p1) is None)
+        self.assertFalse(solver.aborted)
+        self.assertEquals(board.get_stones(),
+                          make_threat_board([(9, 9), (9, 10)],
+                                            [(10, 10), (10, 9)]).get_stones())
+
+    def test_defender_four_is_blocked_first(self):
+        # p2 threatens five at (5, 12), where p1's block also makes an
+        # open four; the open four at (5, 8) would come too late.
+        board = make_threat_board([(0, 12), (5, 9), (5, 10), (5, 11)],
+                                  [(1, 12), (2, 12), (3, 12), (4, 12)])
+        line = ThreatSolver().solve(board, p1)
+        self.assertEquals(line[0], pack_move(5, 12))
+        self.assert_line_wins(board, line)
+
+class TestBitBoard(TestCase):
+    def assert_same_state(self, board, bitboard):
+        for player in (p1, p2):
+            self.assertEquals(board.get_hval(player.pid),
+                              bitboard.get_hval(player.pid))
+            self.assertEquals(board.has_five(player.pid),
+                              bitboard.has_five(player.pid))
+        self.assertEquals(board.get_hash(), bitboard.get_hash())
+        self.assertEquals(board.get_possible_moves().data,
+                          bitboard.get_possible_moves().data)
+
+    def test_matches_board_on_random_games(self):
+        rand = Random(7)
+        for _ in xrange(20):
+            board = Board()
+            moves = play_random_moves(board, 40, rand)
+            bitboard = BitBoard()
+            player = p1
+            for (x, y) in moves:
+                bitboard.put_at(x, y, player)
+                self.assertTrue(bitboard.get_owner_at(x, y) is player)
+                player = player.get_next()
+            self.assert_same_state(board, bitboard)
+            rand.shuffle(moves)
+            for (x, y) in moves[:20]:
+                board.del_at(x, y)
+                bitboard.del_at(x, y)
+                self.assertTrue(bitboard.is_empty(x, y))
+                for player in (p1, p2):
+                    self.assertEquals(board.get_hval(player.pid),
+                                      bitboard.get_hval(player.pid))
+
+    def test_run_hvals_match_groups(self):
+        rand = Random(22)
+        for _ in xrange(10):
+            board = Board()
+            moves = play_random_moves(board, 40, rand)
+            bitboard = BitBoard()
+            player = p1
+            for (x, y) in moves:
+                bitboard.put_at(x, y, player)
+                player = player.get_next()
+            for (x, y) in moves:
+                self.assertEquals(bitboard.get_run_hval_at(x, y),
+                                  board.get_run_hval_at(x, y))
+
+    def test_five_in_a_row(self):
+        bitboard = BitBoard()
+        for x in xrange(3, 7):
+            bitboard.put_at(x, 4, p1)
+        self.assertFalse(bitboard.has_five(p1.pid))
+        bitboard.put_at(7, 4, p1)
+        self.assertTrue(bitboard.has_five(p1.pid))
+        self.assertTrue(bitboard.has_five_through(5, 4, p1.pid))
+        self.assertFalse(bitboard.has_five_through(5, 5, p1.pid))
+
+    def test_win_needs_the_run_through_the_stone(self):
+        # a five and a lone stone on one row, and on one diagonal.
+        for board in (Board(), BitBoard()):
+            for x in xrange(5):
+                board.put_at(x, 5, p1)
+                board.put_at(x, x + 8, p1)
+            board.put_at(12, 5, p1)
+            self.assertFalse(board.is_win_at(12, 5))
+            self.assertFalse(board.last_move_wins())
+            board.put_at(10, 18, p1)
+            self.assertFalse(board.is_win_at(10, 18))
+            self.assertTrue(board.is_win_at(2, 5))
+            self.assertTrue(board.is_win_at(4, 12))
+
+    def test_same_search_result(self):
+        future = Future(make_search_board(), p2)
+        value = future.alphabeta(3, -(1 << 60), (1 << 60), p2)
+        bit_future = Future(make_search_board(BitBoard), p2)
+        bit_value = bit_future.alphabeta(3, -(1 << 60), (1 << 60), p2)
+        self.assertEquals(bit_value, value)
+        self.assertEquals(bit_future.move, future.move)
+
+class TestPatternEvaluator(TestCase):
+    def make_board(self, pts, p=p1):
+        board = Board()
+        board.set_evaluator(PatternEvaluator())
+        for (x, y) in pts:
+            board.put_at(x, y, p)
+        return board
+
+    def test_runs_score_like_groups(self):
+        board = self.make_board([(3, 5), (4, 5), (5, 5), (8, 8), (9, 9)])
+        board.put_at(6, 5, p2)
+        self.assertEquals(board.get_hval(p1.pid),
+                          board.get_piece_groups()[p1.pid].get_hval())
+
+    def test_split_three(self):
+        split = self.make_board([(3, 5), (4, 5), (6, 5)])
+        self.assertTrue(split.get_hval(p1.pid) >
+                        split.get_piece_groups()[p1.pid].get_hval())
+        solid = self.make_board([(3, 5), (4, 5), (5, 5)])
+        self.assertTrue(split.get_hval(p1.pid) >= solid.get_hval(p1.pid))
+
+    def test_overline_scores_like_its_group(self):
+        board = self.make_board([(x, 5) for x in xrange(3, 9)])
+        self.assertEquals(board.get_hval(p1.pid),
+                          board.get_piece_groups()[p1.pid].get_hval())
+        self.assertEquals(board.get_hval(p1.pid), len2hval(6))
+
+    def test_incremental_matches_rescan(self):
+        rand = Random(3)
+        board = self.make_board([])
+        moves = play_random_moves(board, 40, rand)
+        for (x, y) in moves[:20]:
+            board.del_at(x, y)
+        rescan = PatternEvaluator()
+        rescan.attach(board)
+        for player in (p1, p2):
+            self.assertEquals(board.get_hval(player.pid),
+                              rescan.get_hval(player.pid))
+
+@skipIf(npeval.numpy is None, 'numpy is not installed')
+class TestNumpyEvaluator(TestCase):
+    def test_agrees_with_groups_on_random_positions(self):
+        rand = Random(11)
+        for _ in xrange(20):
+            board = Board()
+            play_random_moves(board, rand.randrange(10, 60), rand)
+            expected = Future(board, p1).heuristic_eval()
+            board.set_evaluator(npeval.NumpyEvaluator())
+            self.assertEquals(Future(board, p1).heuristic_eval(), expected)
+
+    def test_batch(self):
+        rand = Random(5)
+        boards = []
+        expected = []
+        for _ in xrange(5):
+            board = Board()
+            play_random_moves(board, 30, rand)
+            boards.append(npeval.board_to_array(board))
+            expected.append([board.get_hval(p.pid) for p in (p1, p2)])
+        hvals = npeval.evaluate_batch(boards)
+        self.assertEquals(hvals.tolist(), expected)
+
+    def test_follows_board_changes(self):
+        board = Board()
+        board.set_evaluator(npeval.NumpyEvaluator())
+        for x in xrange(4, 8):
+            board.put_at(x, 4, p1)
+        board.put_at(8, 4, p2)
+        self.assertEquals(board.get_hval(p1.pid),
+                          board.get_piece_groups()[p1.pid].get_hval())
+        board.del_at(8, 4)
+        self.assertEquals(board.get_hval(p1.pid),
+                          board.get_piece_groups()[p1.pid].get_hval())
+
+class TestRootParallelSearch(TestCase):
+    def test_same_value_as_sequential(self):
+        from parallel import RootParallelSearch
+        future = Future(make_search_board(), p2)
+        value = future.alphabeta(3, -(1 << 60), (1 << 60), p2)
+        searcher = RootParallelSearch(2)
+        try:
+            board = make_search_board()
+            self.assertEquals(searcher.search(board, p2, 3), value)
+            x, y = searcher.move
+            self.assertTrue(board.is_empty(x, y))
+            self.assertTrue(searcher.nodes > 0)
+        finally:
+            searcher.close()
+
+class TestLazySMP(TestCase):
+    def test_shared_table_round_trip(self):
+        from smp import SharedTranspositionTable
+        from model import TT_LOWER
+        table = SharedTranspositionTable(size_bits=8)
+        self.assertFalse(table.probe(12345))
+        table.store(12345, 3, TT_LOWER, -4200, pack_move(7, 9))
+        self.assertTrue(table.probe(12345))
+        self.assertEquals(table.probed_depth, 3)
+        self.assertEquals(table.probed_flag, TT_LOWER)
+        self.assertEquals(table.probed_value, -4200)
+        self.assertEquals(table.probed_move, pack_move(7, 9))
+        # same slot, different key.
+        self.assertFalse(table.probe(12345 + (1 << 8)))
+        # too big to pack -- not stored.
+        table.store(999, 2, TT_LOWER, 1 << 60, pack_move(1, 1))
+        self.assertFalse(table.probe(999))
+
+    def test_search_with_helpers(self):
+        from smp import LazySMPSearch
+        searcher = LazySMPSearch(2, size_bits=12)
+        board = make_search_board()
+        searcher.search(board, p2, 2)
+        x, y = searcher.move
+        self.assertTrue(board.is_empty(x, y))
+        self.assertEquals(searcher.state.completed_depth, 2)
+
+class TestPondering(TestCase):
+    def start_pondering(self):
+        from smp import SharedTranspositionTable
+        from ponder import Ponderer
+        state = SearchState(SharedTranspositionTable(12), MoveOrderer())
+        board = make_search_board()
+        future = Future(board, p2, state)
+        future.iterative_deepening(2, p2)
+        x, y = future.move
+        board.put_at(x, y, p2)
+        ponderer = Ponderer(state.ttable)
+        self.assertTrue(ponderer.start(board, p2, 2, state, False))
+        return (board, ponderer)
+
+    def test_hit_plays_the_ponder_move(self):
+        (board, ponderer) = self.start_pondering()
+        move = ponderer.expected
+        board.put_at(unpack_move_x(move), unpack_move_y(move), p1)
+        self.assertTrue(ponderer.finish(board))
+        self.assertEquals(ponderer.hits, 1)
+        self.assertEquals(ponderer.completed_depth, 2)
+        x, y = ponderer.move
+        self.assertTrue(board.is_empty(x, y))
+
+    def test_miss_stops_pondering(self):
+        (board, ponderer) = self.start_pondering()
+        for move in board.get_possible_moves().to_list():
+            if move != ponderer.expected:
+                break
+        board.put_at(unpack_move_x(move), unpack_move_y(move), p1)
+        self.assertFalse(ponderer.finish(board))
+        self.assertEquals(ponderer.misses, 1)
+        self.assertTrue(ponderer.move is None)
+        self.assertTrue(ponderer.process is None)
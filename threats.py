@@ -0,0 +1,397 @@
+""" threats.py
+
+    Threat-space search: looks for a forced win made only of threats the
+    defender has to answer, before the main search runs.
+
+        - a four threatens five on the next move; the only answer is the
+          cell that completes it,
+        - a three can become a straight four (two completing cells) on
+          the next move; the answers are the cells that stop that.
+
+    Wins by continuous fours (VCF) are searched first, since the
+    defender's answers are forced and the tree stays tiny; then wins that
+    also use threes (VCT). The defender may answer a three with a four of
+    its own too, which the attacker then has to block with a threat of
+    its own. Deep lines of 10-20 plies are cheap this way, where the
+    full-width search would never get there.
+
+    Shapes are looked at through the 5-cell (fours) and 6-cell (threes)
+    windows along the four lines through a cell, which also catches split
+    shapes (XX_XX, X_XXX) that the piece groups don't hold. Cells are
+    looked at with up to two stones "virtually" placed, so classifying a
+    candidate move doesn't need a put_at/unmake_at.
+"""
+
+from model import NO_MOVE, pack_move, unpack_move_x, unpack_move_y
+from pieces import DIRECTION_STEPS
+
+# owner_of() results besides a pid.
+EMPTY = -1
+BLOCKED = -2
+
+# How far the solver looks, in attacker moves.
+VCF_DEPTH = 10
+VCT_DEPTH = 5
+# A few seconds on CPython. The wins found in games took a few hundred
+# nodes; the searches that found nothing often took many thousands.
+NODE_LIMIT = 1000
+
+def owner_of(board, x, y, move1, pid1, move2, pid2):
+    """ The pid at (x, y), with pid1 at move1 and pid2 at move2 as if
+        they were on the board. EMPTY or BLOCKED (off the board) for no
+        pid.
+    """
+    if not board.pos_is_valid(x, y):
+        return BLOCKED
+    move = pack_move(x, y)
+    if move == move1:
+        return pid1
+    elif move == move2:
+        return pid2
+    owner = board.get_owner_at(x, y)
+    if owner is None:
+        return EMPTY
+    return owner.pid
+
+def add_five_cells(board, x, y, direction, pid, move1, pid1, move2, pid2,
+                   cells):
+    """ Adds to cells the empty cells that would complete five for pid in
+        a window through (x, y) along direction.
+    """
+    (dx, dy) = DIRECTION_STEPS[direction]
+    for start in xrange(-4, 1):
+        own = 0
+        gap = NO_MOVE
+        for i in xrange(start, start + 5):
+            cx = x + i * dx
+            cy = y + i * dy
+            owner = owner_of(board, cx, cy, move1, pid1, move2, pid2)
+            if owner == pid:
+                own += 1
+            elif owner == EMPTY and gap == NO_MOVE:
+                gap = pack_move(cx, cy)
+            else:
+                break
+        if own == 4 and gap != NO_MOVE and gap not in cells:
+            cells.append(gap)
+
+def get_five_cells(board, x, y, pid):
+    """ The cells completing five for pid on any line through pid's
+        stone at (x, y).
+    """
+    cells = []
+    for direction in xrange(len(DIRECTION_STEPS)):
+        if count_line(board, x, y, direction, pid) >= 3:
+            add_five_cells(board, x, y, direction, pid, NO_MOVE, EMPTY,
+                           NO_MOVE, EMPTY, cells)
+    return cells
+
+def get_recent_five_cells(board, history_depth, pid):
+    """ The cells completing five for pid on the lines through pid's
+        stones among the last history_depth moves, latest first.
+    """
+    cells = []
+    history = board.history
+    start = max(0, len(history) - history_depth)
+    for i in xrange(len(history) - 1, start - 1, -1):
+        x = unpack_move_x(history[i])
+        y = unpack_move_y(history[i])
+        owner = board.get_owner_at(x, y)
+        if owner is None or owner.pid != pid:
+            continue
+        for move in get_five_cells(board, x, y, pid):
+            if move not in cells:
+                cells.append(move)
+    return cells
+
+def count_line(board, x, y, direction, pid):
+    """ pid's pieces within 4 cells of (x, y) along direction. Cheap, so
+        it's used to skip the lines where pid can't have a shape.
+    """
+    (dx, dy) = DIRECTION_STEPS[direction]
+    count = 0
+    for i in xrange(-4, 5):
+        if i != 0:
+            owner = board.get_owner_at(x + i * dx, y + i * dy)
+            if owner is not None and owner.pid == pid:
+                count += 1
+    return count
+
+def has_straight_four_cell(board, x, y, direction, pid, move1, pid1):
+    """ Whether pid can make a straight four (_XXXX_) through (x, y) along
+        direction with one more stone: some 6-cell window has both ends
+        empty and three of pid's pieces and an empty cell in between.
+    """
+    (dx, dy) = DIRECTION_STEPS[direction]
+    for start in xrange(-5, 1):
+        if (owner_of(board, x + start * dx, y + start * dy, move1, pid1,
+                     NO_MOVE, EMPTY) != EMPTY or
+                owner_of(board, x + (start + 5) * dx, y + (start + 5) * dy,
+                         move1, pid1, NO_MOVE, EMPTY) != EMPTY):
+            continue
+        own = 0
+        empty = 0
+        for i in xrange(start + 1, start + 5):
+            owner = owner_of(board, x + i * dx, y + i * dy, move1, pid1,
+                             NO_MOVE, EMPTY)
+            if owner == pid:
+                own += 1
+            elif owner == EMPTY:
+                empty += 1
+        if own == 3 and empty == 1:
+            return True
+    return False
+
+def makes_five(board, x, y, pid):
+    """ Whether pid playing the empty (x, y) gets five or more. """
+    move = pack_move(x, y)
+    for (dx, dy) in DIRECTION_STEPS:
+        count = 1
+        for sign in (1, -1):
+            cx = x + sign * dx
+            cy = y + sign * dy
+            while owner_of(board, cx, cy, move, pid, NO_MOVE,
+                           EMPTY) == pid:
+                count += 1
+                cx += sign * dx
+                cy += sign * dy
+        if count >= 5:
+            return True
+    return False
+
+def makes_four_in(board, x, y, direction, pid):
+    """ Whether pid playing the empty (x, y) threatens five along
+        direction.
+    """
+    cells = []
+    add_five_cells(board, x, y, direction, pid, pack_move(x, y), pid,
+                   NO_MOVE, EMPTY, cells)
+    return len(cells) > 0
+
+def makes_three_in(board, x, y, direction, pid):
+    """ Whether pid playing the empty (x, y) could make a straight four
+        along direction next.
+    """
+    return has_straight_four_cell(board, x, y, direction, pid,
+                                  pack_move(x, y), pid)
+
+def is_four(board, x, y, pid):
+    """ Whether pid playing the empty (x, y) threatens five. """
+    for direction in xrange(len(DIRECTION_STEPS)):
+        if (count_line(board, x, y, direction, pid) >= 3 and
+                makes_four_in(board, x, y, direction, pid)):
+            return True
+    return False
+
+def get_three_directions(board, x, y, pid):
+    """ The directions in which pid playing the empty (x, y) makes a
+        three, i.e. could make a straight four next.
+    """
+    res = []
+    for direction in xrange(len(DIRECTION_STEPS)):
+        if (count_line(board, x, y, direction, pid) >= 2 and
+                makes_three_in(board, x, y, direction, pid)):
+            res.append(direction)
+    return res
+
+def get_three_directions_at(board, x, y, pid):
+    """ get_three_directions() for pid's stone already at (x, y). """
+    res = []
+    for direction in xrange(len(DIRECTION_STEPS)):
+        if (count_line(board, x, y, direction, pid) >= 2 and
+                has_straight_four_cell(board, x, y, direction, pid, NO_MOVE,
+                                       EMPTY)):
+            res.append(direction)
+    return res
+
+def get_three_defences(board, x, y, direction, pid, defences):
+    """ Adds to defences the empty cells where the defender stops the
+        three through pid's stone at (x, y) from becoming a straight
+        four.
+    """
+    (dx, dy) = DIRECTION_STEPS[direction]
+    for i in xrange(-5, 6):
+        cx = x + i * dx
+        cy = y + i * dy
+        if i == 0 or not board.is_empty(cx, cy):
+            continue
+        move = pack_move(cx, cy)
+        if move in defences:
+            continue
+        # any pid other than pid's own blocks the cell.
+        if not has_straight_four_cell(board, x, y, direction, pid, move,
+                                      BLOCKED):
+            defences.append(move)
+
+
+class ThreatSolver(object):
+    """ Searches a board for a forced win of a player. solve() returns
+        the winning line as packed moves, attacker and defender taking
+        turns, or None; nodes and aborted tell how the search went.
+        Given a SearchState, solve() also gives up when its deadline
+        passes or a stop is requested.
+    """
+    def __init__(self, vcf_depth=VCF_DEPTH, vct_depth=VCT_DEPTH,
+                 node_limit=NODE_LIMIT):
+        self.vcf_depth = vcf_depth
+        self.vct_depth = vct_depth
+        self.node_limit = node_limit
+        self.state = None
+        self.nodes = 0
+        # the node or time limit was hit, so "no win" isn't a proof.
+        self.aborted = False
+
+    def solve(self, board, attacker, state=None):
+        self.state = state
+        self.nodes = 0
+        self.aborted = False
+        defender = attacker.get_next()
+        # cells where the defender already threatens five.
+        threats = []
+        for move in board.get_possible_moves().to_list():
+            if makes_five(board, unpack_move_x(move), unpack_move_y(move),
+                          defender.pid):
+                threats.append(move)
+        depth = 1
+        while depth <= self.vcf_depth and not self.aborted:
+            line = self.attack(board, attacker, depth, threats, False)
+            if line is not None:
+                return line
+            depth += 1
+        depth = 1
+        while depth <= self.vct_depth and not self.aborted:
+            line = self.attack(board, attacker, depth, threats, True)
+            if line is not None:
+                return line
+            depth += 1
+        return None
+
+    def get_forcing_moves(self, board, attacker, allow_threes):
+        """ Lists the attacker's fives, then fours, then threes. """
+        pid = attacker.pid
+        fives = []
+        fours = []
+        threes = []
+        counts = [0] * len(DIRECTION_STEPS)
+        for move in board.get_possible_moves().to_list():
+            x = unpack_move_x(move)
+            y = unpack_move_y(move)
+            most = 0
+            for direction in xrange(len(DIRECTION_STEPS)):
+                count = count_line(board, x, y, direction, pid)
+                counts[direction] = count
+                if count > most:
+                    most = count
+            if most < 2:
+                continue
+            if most >= 4 and makes_five(board, x, y, pid):
+                fives.append(move)
+                continue
+            kind = 0
+            for direction in xrange(len(DIRECTION_STEPS)):
+                if (counts[direction] >= 3 and
+                        makes_four_in(board, x, y, direction, pid)):
+                    kind = 2
+                    break
+                if (kind == 0 and allow_threes and counts[direction] >= 2
+                        and makes_three_in(board, x, y, direction, pid)):
+                    kind = 1
+            if kind == 2:
+                fours.append(move)
+            elif kind == 1:
+                threes.append(move)
+        return fives + fours + threes
+
+    def attack(self, board, attacker, depth, threats, allow_threes):
+        """ The winning line for attacker (to move) within depth more
+            threats, or None. threats lists the cells where the defender
+            could complete five.
+        """
+        self.nodes += 1
+        if self.nodes >= self.node_limit or (self.state is not None and
+                                             self.state.check_stop()):
+            self.aborted = True
+            return None
+        open_threats = []
+        for move in threats:
+            if (board.is_empty(unpack_move_x(move), unpack_move_y(move)) and
+                    move not in open_threats):
+                open_threats.append(move)
+
+        moves = self.get_forcing_moves(board, attacker, allow_threes)
+        if moves and makes_five(board, unpack_move_x(moves[0]),
+                                unpack_move_y(moves[0]), attacker.pid):
+            return [moves[0]]
+        if depth == 0 or len(open_threats) > 1:
+            return None
+        if open_threats:
+            # the attacker has to block, and keep up the pressure with it.
+            if open_threats[0] not in moves:
+                return None
+            moves = [open_threats[0]]
+
+        for move in moves:
+            x = unpack_move_x(move)
+            y = unpack_move_y(move)
+            board.put_at(x, y, attacker)
+            line = self.try_threat(board, attacker, x, y, depth, threats,
+                                   allow_threes)
+            board.unmake_at(x, y)
+            if line is not None:
+                return [move] + line
+            if self.aborted:
+                return None
+        return None
+
+    def try_threat(self, board, attacker, x, y, depth, threats,
+                   allow_threes):
+        """ The rest of the winning line after the attacker's threat at
+            (x, y), or None if some answer holds.
+        """
+        gains = get_five_cells(board, x, y, attacker.pid)
+        if len(gains) >= 2:
+            # an open (or double) four: the defender blocks one cell and
+            # the attacker completes the other.
+            return [gains[0], gains[1]]
+        if len(gains) == 1:
+            defences = gains
+        else:
+            defences = []
+            for direction in get_three_directions_at(board, x, y,
+                                                     attacker.pid):
+                get_three_defences(board, x, y, direction, attacker.pid,
+                                   defences)
+            # or a four of the defender's own, which the attacker has to
+            # answer first.
+            defender = attacker.get_next()
+            for move in board.get_possible_moves().to_list():
+                if move not in defences and is_four(
+                        board, unpack_move_x(move), unpack_move_y(move),
+                        defender.pid):
+                    defences.append(move)
+        return self.defend(board, attacker, depth, threats, defences,
+                           allow_threes)
+
+    def defend(self, board, attacker, depth, threats, defences,
+               allow_threes):
+        """ The attacker's win against every answer in defences, following
+            the first one, or None.
+        """
+        defender = attacker.get_next()
+        best_line = None
+        for move in defences:
+            x = unpack_move_x(move)
+            y = unpack_move_y(move)
+            board.put_at(x, y, defender)
+            line = None
+            if not board.is_win_at(x, y):
+                new_threats = threats + get_five_cells(board, x, y,
+                                                       defender.pid)
+                line = self.attack(board, attacker, depth - 1, new_threats,
+                                   allow_threes)
+            board.unmake_at(x, y)
+            if line is None:
+                return None
+            if best_line is None:
+                best_line = [move] + line
+        return best_line
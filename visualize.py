@@ -31,7 +31,8 @@ def visualize_stat(board, player, x, y, hval):
                (player.mark, x, y, hval,))
     # and format their owning piece groups.
     for pid, group_man in enumerate(board.piece_groups):
-        stat = ['%s x %d' % (NUM2WORD[length], len(groups))
+        # an overline is counted with the fives.
+        stat = ['%s x %d' % (NUM2WORD[min(length, 5)], len(groups))
                  for (length, groups) in enumerate(group_man.get_groups())
                  if len(groups) > 0]
         buf.append('[owning-groups for %s -- %s]' % (
@@ -40,3 +41,27 @@ def visualize_stat(board, player, x, y, hval):
     for line in buf:
         print line
 
+
+def visualize_search(state):
+    print '[search-stat -- depth %d, %d nodes, %d cutoffs, %d nodes/s]' % (
+            state.completed_depth, state.nodes, state.cutoffs,
+            int(state.get_nodes_per_second()))
+    if state.use_quiescence:
+        print '[quiescence -- %d nodes, %d cut short]' % (state.qnodes,
+                                                          state.qcutoffs)
+
+def visualize_threats(solver):
+    print '[tss-stat -- forced win, %d nodes]' % solver.nodes
+
+def visualize_mcts(searcher):
+    print ('[mcts-stat -- %d playouts (%d reused), %d playouts/s, '
+           'move visits %d/%d]' % (
+            searcher.playouts, searcher.reused_visits,
+            int(searcher.get_playouts_per_second()),
+            searcher.root.get_most_visited().visits, searcher.root.visits))
+
+def visualize_ponder(ponderer):
+    print ('[ponder-stat -- hit, depth %d, %d nodes in %.2fs, '
+           '%d hits, %d misses]' % (
+            ponderer.completed_depth, ponderer.nodes, ponderer.elapsed,
+            ponderer.hits, ponderer.misses))